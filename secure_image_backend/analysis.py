@@ -0,0 +1,175 @@
+from PIL import Image
+import numpy as np
+import math
+import io
+
+from metrics import stage
+
+
+# Single-pass randomness analysis. Everything is derived from running
+# sums: per-block byte histograms (np.bincount; the file histogram is their
+# sum), the sum of products of adjacent bytes for the serial correlation,
+# and the block histograms again for the entropy map. Memory is bounded by the chunk size plus
+# MAX_BLOCKS histograms, whatever the file size.
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# Blocks are counted one bincount call each; smaller blocks would spend
+# more time in call overhead than in counting
+MIN_BLOCK_SIZE = 4096
+# Past this many blocks, neighbours are merged and the block size doubles
+MAX_BLOCKS = 1024
+
+
+def shannon_entropy(counts):
+    # Bits per byte of each row of a (..., 256) histogram
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum(axis=-1, keepdims=True)
+    p = np.divide(counts, total, out=np.zeros_like(counts), where=total > 0)
+    logs = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    # 0.0 - x rather than -x so constant input gives 0.0, not -0.0
+    return 0.0 - (p * logs).sum(axis=-1)
+
+
+def chi_square_p(chi, dof=255):
+    # Upper tail via the Wilson-Hilferty normal approximation, good to a few
+    # digits at 255 degrees of freedom
+    z = ((chi / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+class ByteAnalyzer:
+    """Feed chunks in order with update(); result() summarizes them."""
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, max_blocks=MAX_BLOCKS):
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.counts = np.zeros(256, dtype=np.int64)
+        self.total = 0
+        self.pair_sum = 0           # sum of x[i] * x[i + 1]
+        self.first = self.last = None
+        self.blocks = []            # (n, 256) arrays of finished block histograms
+        self.n_blocks = 0
+        self.partial = np.zeros(256, dtype=np.int64)
+        self.partial_fill = 0
+
+    def update(self, chunk):
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        if not len(data):
+            return
+        with stage("analyze"):
+            # A product of two bytes fits in uint16 (255 * 255 = 65025)
+            self.pair_sum += int(np.multiply(data[:-1], data[1:], dtype=np.uint16).sum(dtype=np.uint64))
+            if self.last is None:
+                self.first = int(data[0])
+            else:
+                self.pair_sum += self.last * int(data[0])
+            self.last = int(data[-1])
+            self.total += len(data)
+
+            self._update_blocks(data)
+            while self.n_blocks > self.max_blocks:
+                self._merge_blocks()
+
+    def _count(self, data):
+        hist = np.bincount(data, minlength=256)
+        self.counts += hist
+        return hist
+
+    def _update_blocks(self, data):
+        size = self.block_size
+        pos = 0
+        if self.partial_fill:
+            pos = min(size - self.partial_fill, len(data))
+            self.partial += self._count(data[:pos])
+            self.partial_fill += pos
+            if self.partial_fill == size:
+                self._add_blocks(self.partial[None, :])
+                self.partial = np.zeros(256, dtype=np.int64)
+                self.partial_fill = 0
+
+        n = (len(data) - pos) // size
+        if n:
+            rows = data[pos:pos + n * size].reshape(n, size)
+            self._add_blocks(np.stack([self._count(row) for row in rows]))
+            pos += n * size
+
+        if pos < len(data):
+            self.partial += self._count(data[pos:])
+            self.partial_fill += len(data) - pos
+
+    def _add_blocks(self, hist):
+        self.blocks.append(hist)
+        self.n_blocks += len(hist)
+
+    def _merge_blocks(self):
+        blocks = np.concatenate(self.blocks)
+        if len(blocks) % 2:
+            # The odd block out becomes the front half of the partial block
+            self.partial += blocks[-1]
+            self.partial_fill += self.block_size
+            blocks = blocks[:-1]
+        self.blocks = [blocks[0::2] + blocks[1::2]]
+        self.n_blocks = len(self.blocks[0])
+        self.block_size *= 2
+
+    def result(self):
+        n = self.total
+        values = np.arange(256, dtype=np.int64)
+        s1 = int((values * self.counts).sum())
+        s2 = int((values * values * self.counts).sum())
+
+        expected = n / 256
+        chi = float(((self.counts - expected) ** 2).sum() / expected) if n else 0.0
+
+        # Circular, as in `ent`: the last byte pairs with the first
+        serial = None
+        denominator = n * s2 - s1 * s1
+        if denominator:
+            serial = (n * (self.pair_sum + self.last * self.first) - s1 * s1) / denominator
+
+        blocks = list(self.blocks)
+        if self.partial_fill:
+            blocks.append(self.partial[None, :])
+        block_entropy = shannon_entropy(np.concatenate(blocks)) if blocks else np.zeros(0)
+
+        return {
+            "bytes": n,
+            "entropy": round(float(shannon_entropy(self.counts)), 6),
+            "chi_square": round(chi, 3),
+            "chi_square_p": round(chi_square_p(chi), 6) if n else None,
+            "serial_correlation": round(serial, 6) if serial is not None else None,
+            "mean": round(s1 / n, 4) if n else None,
+            "byte_histogram": self.counts.tolist(),
+            "block_size": self.block_size,
+            "block_entropy": np.round(block_entropy, 4).tolist(),
+        }
+
+
+def looks_like_image(head):
+    # Header sniffing only; Image.open does not decode pixel data
+    try:
+        Image.open(io.BytesIO(head))
+        return True
+    except Exception:
+        return False
+
+
+def pixel_histograms(path):
+    # Per-channel 256-bin histograms. Palette and high-bit-depth images are
+    # converted so bins are pixel values, not palette indices.
+    with Image.open(path) as img:
+        with stage("decode"):
+            img.load()
+        fmt, size = img.format, img.size
+        if img.mode not in ("L", "LA", "RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode == "PA" else "RGB")
+        with stage("analyze"):
+            hist = img.histogram()
+        bands = img.getbands()
+    return {
+        "format": fmt,
+        "mode": "".join(bands),
+        "width": size[0],
+        "height": size[1],
+        "channels": {band: hist[i * 256:(i + 1) * 256] for i, band in enumerate(bands)},
+    }
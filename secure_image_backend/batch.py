@@ -0,0 +1,226 @@
+from Crypto.Random import get_random_bytes
+import functools
+import hashlib
+import zipfile
+import tarfile
+import zlib
+import asyncio
+import json
+import io
+import os
+
+from encryption import derive_aes_key, encrypt_image_aes_with_key
+from decryption import decrypt_image_aes_with_key
+from encryption_gcm import key_cache, encrypt_aes_gcm_with_key, encrypt_stream, decrypt_aes_gcm_any
+from executor import run_blocking, pools
+
+
+ALGORITHMS = ("aes-gcm", "chacha20-poly1305", "aes")
+OUTPUT_FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+ENCRYPTED_SUFFIX = ".enc"
+# Largest ZIP member a batch will inflate. Up to workers * 2 members are in
+# memory at once, so this bounds what a small ZIP bomb can expand into.
+MAX_ENTRY_SIZE = int(os.environ.get("SV_BATCH_MAX_ENTRY_BYTES", 256 * 1024 * 1024))
+
+
+class _Sink:
+    # Write-only file object the archive writers stream into; drained after
+    # every entry so the response never holds more than one result.
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        out = b"".join(self.parts)
+        self.parts = []
+        return out
+
+
+class ArchiveWriter:
+    def __init__(self, output_format):
+        self.sink = _Sink()
+        self.format = output_format
+        if output_format == "zip":
+            self.archive = zipfile.ZipFile(self.sink, "w", zipfile.ZIP_STORED)
+        else:
+            self.archive = tarfile.open(fileobj=self.sink, mode="w|")
+
+    def add(self, name, data):
+        if self.format == "zip":
+            self.archive.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            self.archive.addfile(info, io.BytesIO(data))
+        return self.sink.take()
+
+    def close(self):
+        self.archive.close()
+        return self.sink.take()
+
+
+def read_member(zf, info):
+    # The declared size is checked up front, but it comes from the upload,
+    # so the read itself is capped too.
+    try:
+        with zf.open(info) as fp:
+            data = fp.read(MAX_ENTRY_SIZE + 1)
+    except (zipfile.BadZipFile, zlib.error) as e:
+        raise ValueError(f"{info.filename} is corrupt: {e}") from None
+    if len(data) > MAX_ENTRY_SIZE:
+        raise ValueError(f"{info.filename} inflates past {MAX_ENTRY_SIZE} bytes")
+    return data
+
+
+def open_zip_entries(archive_file):
+    # (name, loader) pairs for every file in an uploaded ZIP. Raises
+    # zipfile.BadZipFile if the upload is not a ZIP at all, and ValueError if
+    # a member declares more than MAX_ENTRY_SIZE bytes.
+    zf = zipfile.ZipFile(archive_file)
+    members = [info for info in zf.infolist() if not info.is_dir()]
+    for info in members:
+        if info.file_size > MAX_ENTRY_SIZE:
+            raise ValueError(f"{info.filename} is larger than {MAX_ENTRY_SIZE} bytes")
+
+    # The ZipFile wraps the upload's open file, so reads stay on the
+    # thread-only stream pool
+    def loader(info):
+        return lambda: run_blocking("stream", read_member, zf, info)
+
+    return [(info.filename, loader(info)) for info in members]
+
+
+def upload_entries(files):
+    return [(f.filename or f"file_{i}", f.read) for i, f in enumerate(files)]
+
+
+def derive_gcm_key(password, salt):
+    # Module-level so it pickles when the crypto pool runs in processes (the
+    # cache object itself holds a lock); each process then has its own cache.
+    return key_cache.derive(password, salt)
+
+
+# Transforms are partials over module-level functions so they pickle too.
+
+async def prepare_encrypt(password, algorithm):
+    # One key derivation for the whole batch
+    if algorithm == "aes":
+        key = await run_blocking("crypto", derive_aes_key, password)
+        return functools.partial(encrypt_image_aes_with_key, key=key)
+
+    salt = get_random_bytes(16)
+    key = await run_blocking("crypto", derive_gcm_key, password, salt)
+    if algorithm == "chacha20-poly1305":
+        # Streaming container (the single-shot one is AES-GCM only); every
+        # entry shares the salt, so the cached key is reused (once per worker
+        # process when the pool runs in processes)
+        return functools.partial(encrypt_stream, password=password, algorithm=algorithm, salt=salt)
+    return functools.partial(encrypt_aes_gcm_with_key, key=key, salt=salt)
+
+
+async def prepare_decrypt(password, algorithm):
+    if algorithm == "aes":
+        key = await run_blocking("crypto", derive_aes_key, password)
+        return functools.partial(decrypt_image_aes_with_key, key=key)
+
+    # Salts are per container; entries from one encrypt batch share theirs, so
+    # the key cache turns this into one derivation per worker.
+    return functools.partial(decrypt_aes_gcm_any, password=password)
+
+
+def encrypted_name(name):
+    return name + ENCRYPTED_SUFFIX
+
+
+def decrypted_name(name):
+    if name.endswith(ENCRYPTED_SUFFIX):
+        return name[:-len(ENCRYPTED_SUFFIX)]
+    return name + ".dec"
+
+
+def png_name(name):
+    return os.path.splitext(name)[0] + ".png"
+
+
+async def _process(name, load, transform, pool):
+    try:
+        data = await load()
+        out = await run_blocking(pool, transform, data)
+    except Exception as e:
+        return {"name": name, "status": "error", "error": str(e) or type(e).__name__}, None
+    return {"name": name, "status": "ok", "bytes_in": len(data), "bytes_out": len(out)}, out
+
+
+async def run_batch(entries, transform, rename, output_format, pool="crypto"):
+    """Stream an archive of transformed entries followed by manifest.json.
+
+    Entries are processed in parallel over a window sized to the worker pool
+    and written out in their original order; a failing entry is recorded in
+    the manifest instead of aborting the batch. transform must be picklable
+    when the pool runs in processes.
+    """
+    writer = ArchiveWriter(output_format)
+    window = max(1, pools[pool].workers * 2)
+    manifest = []
+    used = {"manifest.json"}
+
+    tasks = []
+    pending = iter(entries)
+    for name, load in pending:
+        tasks.append(asyncio.ensure_future(_process(name, load, transform, pool)))
+        if len(tasks) >= window:
+            break
+
+    try:
+        while tasks:
+            record, out = await tasks.pop(0)
+            nxt = next(pending, None)
+            if nxt is not None:
+                tasks.append(asyncio.ensure_future(_process(nxt[0], nxt[1], transform, pool)))
+
+            if out is not None:
+                output = rename(record["name"])
+                if output in used:
+                    output = f"{len(manifest)}_{output}"
+                used.add(output)
+                record["output"] = output
+                yield writer.add(output, out)
+            manifest.append(record)
+
+        summary = {
+            "entries": len(manifest),
+            "succeeded": sum(1 for r in manifest if r["status"] == "ok"),
+            "failed": sum(1 for r in manifest if r["status"] != "ok"),
+            "manifest": manifest,
+        }
+        yield writer.add("manifest.json", json.dumps(summary, indent=2).encode())
+        yield writer.close()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def sha256_digest(data):
+    return hashlib.sha256(data).digest()
+
+
+async def digest_entries(entries, pool="crypto"):
+    """SHA-256 every entry in parallel; returns [(name, digest bytes)] in order.
+
+    Unlike run_batch this fails as a whole: a manifest with a missing member
+    would be useless.
+    """
+    window = asyncio.Semaphore(max(1, pools[pool].workers * 2))
+
+    async def digest(name, load):
+        async with window:
+            data = await load()
+            return name, await run_blocking(pool, sha256_digest, data)
+
+    return await asyncio.gather(*(digest(name, load) for name, load in entries))
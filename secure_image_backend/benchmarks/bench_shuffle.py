@@ -0,0 +1,47 @@
+"""Compare block scrambling against the row shuffle on large rasters.
+
+Times the array transforms only (PNG encode/decode is identical for both
+and dominates end-to-end). Run from secure_image_backend/:
+
+    python -m benchmarks.bench_shuffle --width 8160 --height 6120
+"""
+import numpy as np
+import argparse
+
+from encryption import row_permutation, scramble_array
+from decryption import unscramble_array
+from benchmarks.harness import best_of
+
+
+def row_shuffle(arr, key):
+    indices, _ = row_permutation(key, arr.shape[0])
+    return arr[indices]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=int, default=8160)
+    parser.add_argument("--height", type=int, default=6120)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--key", type=int, default=1234)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    arr = rng.integers(0, 256, size=(args.height, args.width, 3), dtype=np.uint8)
+    mp = args.width * args.height / 1e6
+
+    base_t, _ = best_of(row_shuffle, args.repeat, arr, args.key)
+    print(f"image          : {args.width}x{args.height} ({mp:.1f} MP)")
+    print(f"row shuffle    : {base_t * 1000:8.1f} ms")
+
+    for block in (8, 16, 32):
+        for inner in (False, True):
+            enc_t, enc = best_of(scramble_array, args.repeat, arr, args.key, block, inner)
+            dec_t, dec = best_of(unscramble_array, args.repeat, enc, args.key, block, inner)
+            label = f"block {block:>2}{' +inner' if inner else '       '}"
+            print(f"{label}: {enc_t * 1000:8.1f} ms enc ({enc_t / base_t:4.1f}x)  "
+                  f"{dec_t * 1000:8.1f} ms dec  roundtrip={np.array_equal(dec, arr)}")
+
+
+if __name__ == "__main__":
+    main()
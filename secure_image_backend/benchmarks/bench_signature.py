@@ -0,0 +1,85 @@
+"""Compare key generation, signing and verification across signature algorithms.
+
+Signing covers both modes: buffered (the payload is hashed by the scheme)
+and pre-hashed (the payload is streamed through SHA-256/SHA-512 in chunks
+and only the digest is signed). Run from secure_image_backend/:
+
+    python -m benchmarks.bench_signature --size-mb 64
+"""
+import argparse
+import time
+import os
+
+from signature import (SIGNATURE_ALGORITHMS, generate_keys, import_signing_key, new_scheme,
+                       public_half, sign_with_scheme, verify_with_scheme, new_prehash)
+
+CHUNK = 1024 * 1024
+
+
+def rate(func, seconds, *args):
+    # Calls per second over at least `seconds` of wall time
+    count = 0
+    start = time.perf_counter()
+    while True:
+        func(*args)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def prehashed(name, algorithm, payload):
+    h = new_prehash(name, algorithm)
+    view = memoryview(payload)
+    for i in range(0, len(payload), CHUNK):
+        h.update(view[i:i + CHUNK])
+    return h
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=16, help="payload size for the large-file runs")
+    parser.add_argument("--seconds", type=float, default=1.0, help="minimum time per measurement")
+    parser.add_argument("--rsa-keygen", type=int, default=3, help="RSA key generations to time")
+    args = parser.parse_args()
+
+    small = os.urandom(1024)
+    large = os.urandom(int(args.size_mb * 1024 * 1024))
+    print(f"{'algorithm':<11} {'keygen/s':>9} {'sign/s':>9} {'verify/s':>9} "
+          f"{'sign ' + str(args.size_mb) + 'MB':>12} {'prehashed':>10}")
+
+    for algorithm in SIGNATURE_ALGORITHMS:
+        if algorithm == "rsa":
+            # Too slow for a timed loop; average a few
+            start = time.perf_counter()
+            for _ in range(args.rsa_keygen):
+                private, _ = generate_keys(algorithm)
+            keygen = args.rsa_keygen / (time.perf_counter() - start)
+        else:
+            keygen = rate(generate_keys, args.seconds, algorithm)
+            private, _ = generate_keys(algorithm)
+
+        key = import_signing_key(private)
+        signer, verifier = new_scheme(key), new_scheme(public_half(key))
+        sig = sign_with_scheme(signer, small)
+
+        signs = rate(sign_with_scheme, args.seconds, signer, small)
+        verifies = rate(verify_with_scheme, args.seconds, verifier, small, sig)
+
+        start = time.perf_counter()
+        sign_with_scheme(signer, large)
+        buffered = time.perf_counter() - start
+
+        hash_name = "sha512" if algorithm == "ed25519" else "sha256"
+        start = time.perf_counter()
+        h = prehashed(hash_name, algorithm, large)
+        sig = sign_with_scheme(signer, h)
+        streamed = time.perf_counter() - start
+        assert verify_with_scheme(verifier, prehashed(hash_name, algorithm, large), sig)
+
+        print(f"{algorithm:<11} {keygen:9.1f} {signs:9.0f} {verifies:9.0f} "
+              f"{buffered * 1000:10.1f}ms {streamed * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare the vectorized stego engine against the original per-pixel loops.
+
+Run from secure_image_backend/:
+
+    python -m benchmarks.bench_stego --width 2000 --height 1500 --chars 4096
+"""
+from PIL import Image
+import numpy as np
+import argparse
+import io
+
+from stego_hide import hide_message_in_image
+from stego_extract import extract_message
+from benchmarks.harness import best_of
+
+
+def legacy_hide_message_in_image(image_bytes, message):
+    img = Image.open(io.BytesIO(image_bytes))
+    img = img.convert("RGB")
+
+    binary_msg = ''.join(format(ord(i), '08b') for i in message) + "1111111111111110"
+
+    data = list(img.getdata())
+    new_data = []
+
+    msg_index = 0
+
+    for pixel in data:
+        r, g, b = pixel
+
+        if msg_index < len(binary_msg):
+            r = (r & ~1) | int(binary_msg[msg_index])
+            msg_index += 1
+
+        if msg_index < len(binary_msg):
+            g = (g & ~1) | int(binary_msg[msg_index])
+            msg_index += 1
+
+        if msg_index < len(binary_msg):
+            b = (b & ~1) | int(binary_msg[msg_index])
+            msg_index += 1
+
+        new_data.append((r, g, b))
+
+    img.putdata(new_data)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def legacy_extract_message(image_bytes):
+    img = Image.open(io.BytesIO(image_bytes))
+    img = img.convert("RGB")
+
+    data = list(img.getdata())
+    binary = ""
+
+    for pixel in data:
+        r, g, b = pixel
+        binary += str(r & 1)
+        binary += str(g & 1)
+        binary += str(b & 1)
+
+        if "1111111111111110" in binary:
+            break
+
+    binary = binary.split("1111111111111110")[0]
+
+    msg = ""
+    for i in range(0, len(binary), 8):
+        byte = binary[i:i+8]
+        msg += chr(int(byte, 2))
+
+    return msg
+
+
+def make_cover(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    arr = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(arr, "RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--chars", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cover = make_cover(args.width, args.height)
+    message = ("SecureVision " * (args.chars // 13 + 1))[:args.chars]
+
+    legacy_t, legacy_out = best_of(legacy_hide_message_in_image, args.repeat, cover, message)
+    fast_t, fast_out = best_of(hide_message_in_image, args.repeat, cover, message)
+
+    legacy_px = np.array(Image.open(io.BytesIO(legacy_out)))
+    fast_px = np.array(Image.open(io.BytesIO(fast_out)))
+
+    print(f"image      : {args.width}x{args.height}, message {args.chars} chars")
+    print(f"legacy loop: {legacy_t * 1000:10.1f} ms")
+    print(f"vectorized : {fast_t * 1000:10.1f} ms  ({legacy_t / fast_t:.1f}x)")
+    print(f"identical  : pixels={np.array_equal(legacy_px, fast_px)} png={legacy_out == fast_out}")
+
+    legacy_t, legacy_msg = best_of(legacy_extract_message, args.repeat, fast_out)
+    fast_t, fast_msg = best_of(extract_message, args.repeat, fast_out)
+
+    print(f"extract legacy    : {legacy_t * 1000:10.1f} ms")
+    print(f"extract vectorized: {fast_t * 1000:10.1f} ms  ({legacy_t / fast_t:.1f}x)")
+    print(f"identical         : {legacy_msg == fast_msg == message}")
+
+
+if __name__ == "__main__":
+    main()
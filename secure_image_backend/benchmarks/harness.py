@@ -0,0 +1,168 @@
+"""Timing, memory sampling and baseline comparison for the benchmark suite."""
+import numpy as np
+import threading
+import platform
+import time
+import json
+import os
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# Latency changes smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR_MS = 0.05
+
+
+def _rss(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as fp:
+            return int(fp.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as fp:
+            return [int(c) for c in fp.read().split()]
+    except OSError:
+        return []
+
+
+def rss_bytes():
+    # This process plus its direct children, so process-pool workers used by
+    # the routes count towards the peak
+    pid = os.getpid()
+    return _rss(pid) + sum(_rss(child) for child in _children(pid))
+
+
+class RSSSampler:
+    """Samples resident memory in a background thread while a case runs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.start = rss_bytes()
+        self.peak = self.start
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def summarize(latencies, nbytes, sampler):
+    latencies = np.asarray(latencies)
+    p50 = float(np.percentile(latencies, 50))
+    return {
+        "n": int(len(latencies)),
+        "bytes": nbytes,
+        "mean_ms": round(float(latencies.mean()) * 1000, 3),
+        "p50_ms": round(p50 * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "throughput_mb_s": round(nbytes / p50 / 1e6, 2) if nbytes and p50 > 0 else None,
+        "peak_rss_mb": round(sampler.peak / 1e6, 1),
+        "rss_growth_mb": round((sampler.peak - sampler.start) / 1e6, 1),
+    }
+
+
+def measure(func, nbytes, repeat=5, max_seconds=10.0, warmup=1):
+    """Time func() repeat times (fewer if max_seconds runs out, at least once)."""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    with RSSSampler() as sampler:
+        deadline = time.perf_counter() + max_seconds
+        while len(latencies) < repeat and (not latencies or time.perf_counter() < deadline):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies, nbytes, sampler)
+
+
+async def ameasure(make_call, nbytes, repeat=5, max_seconds=10.0, warmup=1, prepare=None):
+    # Async twin of measure(); make_call() returns a fresh awaitable. With
+    # prepare, each call is make_call(await prepare()) and only make_call is
+    # timed (e.g. registering a key for a DELETE to remove).
+    async def timed():
+        args = (await prepare(),) if prepare else ()
+        start = time.perf_counter()
+        await make_call(*args)
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        await timed()
+    latencies = []
+    with RSSSampler() as sampler:
+        deadline = time.perf_counter() + max_seconds
+        while len(latencies) < repeat and (not latencies or time.perf_counter() < deadline):
+            latencies.append(await timed())
+    return summarize(latencies, nbytes, sampler)
+
+
+def best_of(func, repeat, *args):
+    """Fastest of repeat calls to func(*args), with the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def environment():
+    import PIL
+    import Crypto
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "pycryptodome": Crypto.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def save(results, path):
+    with open(path, "w") as fp:
+        json.dump({"environment": environment(), "results": results}, fp, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as fp:
+        return json.load(fp)["results"]
+
+
+def compare(baseline, current, threshold=0.10, rss_threshold=0.25):
+    """Cases whose p50 latency or peak RSS grew past the thresholds.
+
+    Returns (regressions, improvements), each a list of
+    (case, metric, baseline value, current value, relative change).
+    """
+    regressions, improvements = [], []
+    for case in sorted(set(baseline) & set(current)):
+        for metric, limit in (("p50_ms", threshold), ("peak_rss_mb", rss_threshold)):
+            old, new = baseline[case].get(metric), current[case].get(metric)
+            if not old or new is None:
+                continue
+            if metric == "p50_ms" and abs(new - old) < NOISE_FLOOR_MS:
+                continue
+            change = (new - old) / old
+            if change > limit:
+                regressions.append((case, metric, old, new, change))
+            elif change < -limit:
+                improvements.append((case, metric, old, new, change))
+    return regressions, improvements
+
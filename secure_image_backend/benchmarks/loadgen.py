@@ -0,0 +1,413 @@
+"""Concurrent load generator for the FastAPI app.
+
+Starts the app under uvicorn (or targets --url), then drives a weighted mix
+of endpoints with asyncio clients, either open-loop at a target rate
+(--rps) or closed-loop with a fixed number of clients (--concurrency).
+Reports per endpoint: throughput, latency percentiles, error rates and the
+server's event-loop lag while that endpoint was in flight, which is where
+head-of-line blocking shows up. Run from secure_image_backend/:
+
+    python -m benchmarks.loadgen --mix hash=9,gcm-encrypt=1 --rps 50 --duration 30
+    python -m benchmarks.loadgen --mix gcm-encrypt,stego-hide,hash --concurrency 32 --workers 4
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --mix hash --concurrency 8
+
+Open-loop latency is measured from the scheduled send time, so a stalled
+server is not hidden by the client slowing down (coordinated omission).
+"""
+from contextlib import asynccontextmanager
+from collections import defaultdict
+import numpy as np
+import subprocess
+import argparse
+import asyncio
+import signal
+import socket
+import random
+import time
+import json
+import sys
+import os
+
+import httpx
+
+from benchmarks.synthetic import IMAGE_SIZES, parse_size, image_png, payload, text_message
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "loadgen-password"
+KEY = "1234"
+LAG_METRIC = "sv_event_loop_lag_seconds"
+MESSAGE = text_message(256)
+
+
+# ----------------------- Scenarios -----------------------
+#
+# name -> (path, async setup(client, inputs) -> kwargs for client.post).
+# Setup runs once before the load starts; decrypt/extract/verify
+# scenarios get their input from the matching server-side operation.
+
+async def _post(client, path, **kwargs):
+    response = await client.post(path, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def _form(field, kind, **data):
+    async def setup(client, inputs):
+        return {"files": {field: ("load", inputs[kind])}, "data": data}
+    return setup
+
+
+def _from(path, field, kind, result_field, **data):
+    async def setup(client, inputs):
+        response = await _post(client, path, files={field: ("load", inputs[kind])}, data=data)
+        return {"files": {result_field: ("load", response.content)}, "data": data}
+    return setup
+
+
+async def _sign_setup(client, inputs):
+    keys = (await client.get("/signature/generate-keys", params={"algorithm": "ed25519"})).json()
+    return {"files": {"file": ("load", inputs["payload"])}, "data": {"private_key": keys["private_key"]}}
+
+
+async def _verify_setup(client, inputs):
+    keys = (await client.get("/signature/generate-keys", params={"algorithm": "ed25519"})).json()
+    sig = await _post(client, "/signature/sign", files={"file": ("load", inputs["payload"])},
+                      data={"private_key": keys["private_key"]})
+    return {"files": {"file": ("load", inputs["payload"]), "signature_file": ("sig", sig.content)},
+            "data": {"public_key": keys["public_key"]}}
+
+
+SCENARIOS = {
+    "hash": ("/hash", _form("file", "payload")),
+    "analyze": ("/analyze", _form("file", "payload")),
+    "gcm-encrypt": ("/encrypt/aes-gcm", _form("file", "payload", password=PASSWORD)),
+    "gcm-decrypt": ("/decrypt/aes-gcm", _from("/encrypt/aes-gcm", "file", "payload", "file",
+                                              password=PASSWORD)),
+    "aes-encrypt": ("/encrypt/aes", _form("image", "payload", password=PASSWORD)),
+    "aes-decrypt": ("/decrypt/aes", _from("/encrypt/aes", "image", "payload", "file", password=PASSWORD)),
+    "stego-hide": ("/stego/hide", _form("image", "image", message=MESSAGE)),
+    "stego-extract": ("/stego/extract", _from("/stego/hide", "image", "image", "image", message=MESSAGE)),
+    "shuffle": ("/encrypt/shuffle", _form("image", "image", key=KEY)),
+    "scramble": ("/encrypt/scramble", _form("image", "image", key=KEY)),
+    "watermark": ("/watermark", _form("image", "image", text="SecureVision")),
+    "sign": ("/signature/sign", _sign_setup),
+    "verify": ("/signature/verify", _verify_setup),
+}
+
+
+def parse_mix(text):
+    # "hash=9,gcm-encrypt=1" -> {"hash": 9.0, "gcm-encrypt": 1.0}; weight defaults to 1
+    mix = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+        if mix[name] <= 0:
+            raise ValueError(f"Weight for {name!r} must be positive")
+    if not mix:
+        raise ValueError("Empty mix")
+    return mix
+
+
+# ----------------------- Server -----------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def local_server(workers, env, startup_timeout=120):
+    port = free_port()
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    # Own session so the process-pool workers can be swept up with it
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=dict(os.environ, **env),
+                               start_new_session=True)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + startup_timeout
+        async with httpx.AsyncClient(base_url=url) as client:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not come up in time")
+                await asyncio.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+# ----------------------- Measurement -----------------------
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.dropped = defaultdict(int)
+        self.recording = False
+
+    def record(self, name, seconds, status):
+        if self.recording:
+            self.latencies[name].append(seconds)
+            self.statuses[name][status] += 1
+
+
+async def send(client, stats, name, request, scheduled):
+    path, kwargs = request
+    try:
+        response = await client.post(path, **kwargs)
+        await response.aread()
+        status = str(response.status_code)
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.TransportError as e:
+        status = type(e).__name__
+    stats.record(name, time.perf_counter() - scheduled, status)
+
+
+async def open_loop(client, stats, requests, mix, rps, duration, max_in_flight, poisson):
+    names, weights = list(mix), list(mix.values())
+    in_flight = set()
+    next_at = time.perf_counter()
+    end = next_at + duration
+    while next_at < end:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name = random.choices(names, weights)[0]
+        if len(in_flight) >= max_in_flight:
+            if stats.recording:
+                stats.dropped[name] += 1
+        else:
+            task = asyncio.create_task(send(client, stats, name, requests[name], next_at))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_at += random.expovariate(rps) if poisson else 1 / rps
+    await asyncio.gather(*in_flight)
+
+
+async def closed_loop(client, stats, requests, mix, concurrency, duration):
+    names, weights = list(mix), list(mix.values())
+    end = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < end:
+            name = random.choices(names, weights)[0]
+            await send(client, stats, name, requests[name], time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def sample_lag(samples, interval=0.01):
+    # The client's own loop lag; if this is high the client, not the
+    # server, is the bottleneck
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def scrape_lag(client):
+    # {endpoint: ({le: cumulative count}, count, sum)} from /metrics
+    try:
+        text = (await client.get("/metrics")).text
+    except httpx.HTTPError:
+        return {}
+    series = defaultdict(lambda: [{}, 0, 0.0])
+    for line in text.splitlines():
+        if not line.startswith(LAG_METRIC):
+            continue
+        sample, value = line.rsplit(" ", 1)
+        labels = dict(part.split("=", 1) for part in sample[sample.index("{") + 1:-1].split(","))
+        entry = series[labels["endpoint"].strip('"')]
+        if sample.startswith(LAG_METRIC + "_bucket"):
+            entry[0][labels["le"].strip('"')] = float(value)
+        elif sample.startswith(LAG_METRIC + "_count"):
+            entry[1] = float(value)
+        elif sample.startswith(LAG_METRIC + "_sum"):
+            entry[2] = float(value)
+    return series
+
+
+def lag_summary(before, after, endpoint):
+    # Histogram delta over the run; percentiles are bucket upper bounds
+    buckets, count, total = after.get(endpoint, ({}, 0, 0.0))
+    old_buckets, old_count, old_total = before.get(endpoint, ({}, 0, 0.0))
+    count -= old_count
+    if count <= 0:
+        return None
+    bounds = sorted((float(le), n - old_buckets.get(le, 0)) for le, n in buckets.items())
+
+    def percentile(q):
+        for bound, n in bounds:
+            if n >= q * count:
+                return bound * 1000
+        return float("inf")
+
+    return {"samples": int(count), "mean_ms": round((total - old_total) / count * 1000, 2),
+            "p50_ms_le": percentile(0.5), "p99_ms_le": percentile(0.99)}
+
+
+def summarize(stats, mix, paths, elapsed, before, after):
+    report = {}
+    for name in mix:
+        latencies = np.asarray(stats.latencies[name]) * 1000
+        statuses = dict(stats.statuses[name])
+        total = len(latencies) + stats.dropped[name]
+        errors = total - statuses.get("200", 0)
+        entry = {
+            "path": paths[name],
+            "requests": int(len(latencies)),
+            "dropped": stats.dropped[name],
+            "throughput_rps": round(statuses.get("200", 0) / elapsed, 2),
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "statuses": statuses,
+        }
+        if len(latencies):
+            for q in (50, 90, 99):
+                entry[f"p{q}_ms"] = round(float(np.percentile(latencies, q)), 2)
+            entry["max_ms"] = round(float(latencies.max()), 2)
+        entry["server_loop_lag"] = lag_summary(before, after, paths[name])
+        report[name] = entry
+    return report
+
+
+def print_report(report, server_lag, client_lag, elapsed):
+    print(f"\n{'scenario':<14} {'req':>7} {'rps':>8} {'err%':>6} {'p50 ms':>9} {'p90 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}  {'loop lag p99':>12}")
+    for name, entry in report.items():
+        lag = entry["server_loop_lag"]
+        lag_text = f"<={lag['p99_ms_le']:.1f} ms" if lag else "-"
+        print(f"{name:<14} {entry['requests']:>7} {entry['throughput_rps']:>8.1f} "
+              f"{entry['error_rate'] * 100:>6.2f} {entry.get('p50_ms', 0):>9.1f} {entry.get('p90_ms', 0):>9.1f} "
+              f"{entry.get('p99_ms', 0):>9.1f} {entry.get('max_ms', 0):>9.1f}  {lag_text:>12}")
+        failures = {s: n for s, n in entry["statuses"].items() if s != "200"}
+        if failures or entry["dropped"]:
+            print(f"{'':<14} failures: {failures} dropped: {entry['dropped']}")
+    total = sum(e["requests"] for e in report.values())
+    print(f"\n{total} requests in {elapsed:.1f}s")
+    if server_lag:
+        print(f"server loop lag: mean {server_lag['mean_ms']} ms, p50 <={server_lag['p50_ms_le']} ms, "
+              f"p99 <={server_lag['p99_ms_le']} ms over {server_lag['samples']} samples")
+    if client_lag["p99_ms"] > 50:
+        print(f"warning: client loop lag p99 {client_lag['p99_ms']} ms; the load generator is saturated "
+              "and the numbers understate what the server can do")
+
+
+async def run(args, url):
+    mix = parse_mix(args.mix)
+    paths = {name: SCENARIOS[name][0] for name in mix}
+    inputs = {"payload": payload(parse_size(args.payload), args.seed),
+              "image": image_png(*IMAGE_SIZES[args.image], seed=args.seed)}
+    limits = httpx.Limits(max_connections=args.max_in_flight if args.rps else args.concurrency,
+                          max_keepalive_connections=args.concurrency)
+    # /metrics goes over its own connection; queued behind the load's
+    # connection pool it would be scraped seconds late
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client, \
+            httpx.AsyncClient(base_url=url, timeout=args.timeout) as scraper:
+        requests = {}
+        for name in mix:
+            path, setup = SCENARIOS[name]
+            requests[name] = (path, await setup(client, inputs))
+
+        stats = Stats()
+        client_lag = []
+        lag_task = asyncio.create_task(sample_lag(client_lag))
+        if args.rps:
+            load = open_loop(client, stats, requests, mix, args.rps, args.warmup + args.duration,
+                             args.max_in_flight, args.poisson)
+        else:
+            load = closed_loop(client, stats, requests, mix, args.concurrency, args.warmup + args.duration)
+        load_task = asyncio.create_task(load)
+
+        await asyncio.sleep(args.warmup)
+        before = await scrape_lag(scraper)
+        stats.recording = True
+        start = time.perf_counter()
+        await load_task
+        elapsed = time.perf_counter() - start
+        after = await scrape_lag(scraper)
+        lag_task.cancel()
+
+    report = summarize(stats, mix, paths, elapsed, before, after)
+    lag = np.asarray(client_lag or [0.0]) * 1000
+    client = {"p99_ms": round(float(np.percentile(lag, 99)), 2), "max_ms": round(float(lag.max()), 2)}
+    server = lag_summary(before, after, "all")
+    print_report(report, server, client, elapsed)
+    return {"config": vars(args), "elapsed_seconds": round(elapsed, 2), "endpoints": report,
+            "server_loop_lag": server, "client_loop_lag": client}
+
+
+async def main_async(args):
+    if args.url:
+        return await run(args, args.url)
+    # Every request repeats its scenario's input, so the result cache would
+    # answer most of them unless asked for
+    env = {} if args.cache else {"SV_RESULT_CACHE_BYTES": "0"}
+    async with local_server(args.workers, env) as url:
+        return await run(args, url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="\n".join(__doc__.splitlines()[2:]))
+    parser.add_argument("--mix", default="hash=9,gcm-encrypt=1",
+                        help=f"weighted scenarios, name[=weight],... ({', '.join(SCENARIOS)})")
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument("--rps", type=float, help="open loop: requests per second across the mix")
+    rate.add_argument("--concurrency", type=int, default=16, help="closed loop: concurrent clients")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times with --rps")
+    parser.add_argument("--max-in-flight", type=int, default=1000,
+                        help="with --rps, arrivals beyond this many outstanding requests are dropped")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of load excluded from results")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--payload", default="1M", help="payload size for file scenarios, e.g. 64K, 16M")
+    parser.add_argument("--image", default="1k", help=f"image size ({', '.join(IMAGE_SIZES)})")
+    parser.add_argument("--url", help="target a running server instead of starting one")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn workers; /metrics, and so loop lag, then covers one worker")
+    parser.add_argument("--cache", action="store_true",
+                        help="leave the result cache on for the started server (off by default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.image not in IMAGE_SIZES:
+        parser.error(f"unknown image size {args.image!r}")
+    if args.rps is not None and args.rps <= 0:
+        parser.error("--rps must be positive")
+
+    result = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(result, fp, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""Benchmark every backend module and route on synthetic inputs.
+
+Times the public functions directly and the FastAPI routes in-process
+through the ASGI app (no server, no network), and writes p50/p99 latency,
+throughput and peak RSS per case to JSON. Run from secure_image_backend/:
+
+    python -m benchmarks.suite run --sizes 256,1k,2k --payloads 1K,1M,16M -o bench.json
+    python -m benchmarks.suite run --sizes 8k,16k --payloads 1G --only gcm,hash
+    python -m benchmarks.suite run -o new.json --baseline bench.json
+    python -m benchmarks.suite compare bench.json new.json
+
+Case names are "<fn|route>:<name>:<input>", e.g. "route:/stego/hide:2k".
+Image sizes: 256, 512, 1k, 2k, 4k, 8k, 16k. Payload sizes take K/M/G.
+"""
+import argparse
+import tempfile
+import asyncio
+import json
+import sys
+import os
+
+from benchmarks.synthetic import (IMAGE_SIZES, DEFAULT_IMAGE_SIZES, DEFAULT_PAYLOADS, parse_size,
+                                  image_png, payload, text_message)
+from benchmarks.harness import measure, ameasure, save, load, compare
+
+GROUPS = ("stego", "aes", "shuffle", "scramble", "gcm", "watermark", "signature", "hash", "analyze",
+          "batch", "manifest", "keys", "pipeline", "attack")
+PASSWORD = "benchmark-password"
+SHUFFLE_KEY = 1234
+# Multi-file routes get the payload split into this many files, or this
+# many copies of the image
+BATCH_FILES = 4
+# Inputs written to disk for functions that take a path; removed at exit
+TEMP_FILES = []
+
+
+# ----------------------- Function cases -----------------------
+#
+# Each case is (group, name, input kind, setup). setup(data) runs once,
+# untimed, and returns the zero-argument callable that gets timed.
+
+def function_cases(message, signature_algorithms):
+    from stego_hide import hide_message_in_image, hide_payload_in_image
+    from stego_extract import extract_message, extract_payload
+    from encryption import (encrypt_image_aes, encrypt_image_shuffle, encrypt_image_scramble,
+                            derive_aes_key)
+    from decryption import decrypt_image_aes, decrypt_image_shuffle, decrypt_image_scramble
+    from encryption_gcm import (encrypt_aes_gcm, encrypt_stream, decrypt_aes_gcm_any, AEADS)
+    from watermark import add_watermark
+    from signature import generate_keys, sign_data, verify_signature
+    from utils import generate_sha256
+    from analysis import ByteAnalyzer, pixel_histograms
+
+    def stego_extract_setup(data):
+        hidden = hide_message_in_image(data, message)
+        return lambda: extract_message(hidden)
+
+    def stego_v2_extract_setup(data):
+        hidden = hide_payload_in_image(data, message.encode(), 2)
+        return lambda: extract_payload(hidden)
+
+    def analyze_setup(data):
+        def analyze():
+            analyzer = ByteAnalyzer()
+            for start in range(0, len(data), 1024 * 1024):
+                analyzer.update(data[start:start + 1024 * 1024])
+            return analyzer.result()
+        return analyze
+
+    def pixel_histograms_setup(data):
+        fd, path = tempfile.mkstemp(prefix="securevision-bench-")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        TEMP_FILES.append(path)
+        return lambda: pixel_histograms(path)
+
+    def aes_decrypt_setup(data):
+        enc = encrypt_image_aes(data, PASSWORD)
+        return lambda: decrypt_image_aes(enc, PASSWORD)
+
+    def shuffle_decrypt_setup(data):
+        enc = encrypt_image_shuffle(data, SHUFFLE_KEY)
+        return lambda: decrypt_image_shuffle(enc, SHUFFLE_KEY)
+
+    def scramble_decrypt_setup(data):
+        enc = encrypt_image_scramble(data, SHUFFLE_KEY)
+        return lambda: decrypt_image_scramble(enc, SHUFFLE_KEY)
+
+    cases = [
+        ("stego", "stego_hide.hide_message_in_image", "image",
+         lambda data: lambda: hide_message_in_image(data, message)),
+        ("stego", "stego_extract.extract_message", "image", stego_extract_setup),
+        ("stego", "stego_hide.hide_payload_in_image", "image",
+         lambda data: lambda: hide_payload_in_image(data, message.encode(), 2)),
+        ("stego", "stego_extract.extract_payload", "image", stego_v2_extract_setup),
+        ("aes", "encryption.derive_aes_key", None, lambda _: lambda: derive_aes_key(PASSWORD)),
+        ("aes", "encryption.encrypt_image_aes", "payload",
+         lambda data: lambda: encrypt_image_aes(data, PASSWORD)),
+        ("aes", "decryption.decrypt_image_aes", "payload", aes_decrypt_setup),
+        ("shuffle", "encryption.encrypt_image_shuffle", "image",
+         lambda data: lambda: encrypt_image_shuffle(data, SHUFFLE_KEY)),
+        ("shuffle", "decryption.decrypt_image_shuffle", "image", shuffle_decrypt_setup),
+        ("scramble", "encryption.encrypt_image_scramble", "image",
+         lambda data: lambda: encrypt_image_scramble(data, SHUFFLE_KEY)),
+        ("scramble", "decryption.decrypt_image_scramble", "image", scramble_decrypt_setup),
+        # Full cost including a fresh PBKDF2 per call
+        ("gcm", "encryption_gcm.encrypt_aes_gcm", "payload",
+         lambda data: lambda: encrypt_aes_gcm(data, PASSWORD)),
+        ("watermark", "watermark.add_watermark", "image",
+         lambda data: lambda: add_watermark(data, "SecureVision")),
+        ("hash", "utils.generate_sha256", "payload", lambda data: lambda: generate_sha256(data)),
+        ("analyze", "analysis.ByteAnalyzer", "payload", analyze_setup),
+        ("analyze", "analysis.pixel_histograms", "image", pixel_histograms_setup),
+    ]
+
+    # Cipher cost alone: a fixed salt keeps the derived key cached
+    salt = os.urandom(16)
+    for aead in AEADS:
+        def encrypt_setup(data, aead=aead):
+            return lambda: encrypt_stream(data, PASSWORD, aead, salt)
+
+        def decrypt_setup(data, aead=aead):
+            enc = encrypt_stream(data, PASSWORD, aead, salt)
+            return lambda: decrypt_aes_gcm_any(enc, PASSWORD)
+
+        cases.append(("gcm", f"encryption_gcm.encrypt_stream[{aead}]", "payload", encrypt_setup))
+        cases.append(("gcm", f"encryption_gcm.decrypt_aes_gcm_any[{aead}]", "payload", decrypt_setup))
+
+    for algorithm in signature_algorithms:
+        private, public = generate_keys(algorithm)
+
+        def verify_setup(data, private=private, public=public):
+            sig = sign_data(data, private)
+            return lambda: verify_signature(data, sig, public)
+
+        cases.append(("signature", f"signature.generate_keys[{algorithm}]", None,
+                      lambda _, algorithm=algorithm: lambda: generate_keys(algorithm)))
+        cases.append(("signature", f"signature.sign_data[{algorithm}]", "payload",
+                      lambda data, private=private: lambda: sign_data(data, private)))
+        cases.append(("signature", f"signature.verify_signature[{algorithm}]", "payload", verify_setup))
+    return cases
+
+
+# ----------------------- Route cases -----------------------
+#
+# (group, path, input kind, setup) where async setup(client, data) returns
+# the request kwargs for client.request(). Besides httpx arguments these may
+# hold "method" (default POST), "url" (default the path without its
+# [variant]), "nbytes" (default the input size) and "prepare", an async
+# function run untimed before every call whose result is merged into the
+# kwargs.
+
+def route_cases(message, signature_algorithms):
+    async def post(client, path, **kwargs):
+        response = await client.post(path, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+        return response.content
+
+    def image(field="image", **form):
+        async def setup(client, data):
+            return {"files": {field: ("bench.png", data)}, "data": form}
+        return setup
+
+    def upload(field="file", **form):
+        async def setup(client, data):
+            return {"files": {field: ("bench.bin", data)}, "data": form}
+        return setup
+
+    def encrypted(path, field, result_field="file", **form):
+        # Decrypt/extract routes need their input produced by the matching route
+        async def setup(client, data):
+            enc = await post(client, path, files={field: ("bench", data)}, data=form)
+            return {"files": {result_field: ("bench", enc)}, "data": form}
+        return setup
+
+    def form(**fields):
+        async def setup(client, data):
+            return {"data": fields}
+        return setup
+
+    def split(data):
+        size = -(-len(data) // BATCH_FILES)
+        return [(f"part{i}.bin", data[i * size:(i + 1) * size]) for i in range(BATCH_FILES)]
+
+    def files(**form):
+        async def setup(client, data):
+            return {"files": [("files", part) for part in split(data)], "data": form}
+        return setup
+
+    def images(**form):
+        async def setup(client, data):
+            return {"files": [("files", (f"bench{i}.png", data)) for i in range(BATCH_FILES)],
+                    "data": form, "nbytes": len(data) * BATCH_FILES}
+        return setup
+
+    async def batch_decrypt_setup(client, data):
+        archive = await post(client, "/batch/encrypt", files=[("files", part) for part in split(data)],
+                             data={"password": PASSWORD})
+        return {"files": {"archive": ("bench.zip", archive)}, "data": {"password": PASSWORD}}
+
+    async def new_key(client, algorithm="ed25519"):
+        response = await client.post("/keys/generate", data={"algorithm": algorithm})
+        return response.json()
+
+    async def manifest(client, data, key_id):
+        response = await client.post("/manifest/create", files=[("files", part) for part in split(data)],
+                                     data={"key_id": key_id, "include_proofs": "true"})
+        return response.json()
+
+    async def manifest_create_setup(client, data):
+        return {"files": [("files", part) for part in split(data)],
+                "data": {"key_id": (await new_key(client))["key_id"]}}
+
+    async def manifest_proof_setup(client, data):
+        created = await manifest(client, data, (await new_key(client))["key_id"])
+        return {"files": {"manifest": ("manifest.json", json.dumps(created["manifest"]))},
+                "data": {"name": "part0.bin"}}
+
+    async def manifest_verify_setup(client, data):
+        key_id = (await new_key(client))["key_id"]
+        created = await manifest(client, data, key_id)
+        return {"files": {"file": split(data)[0]},
+                "data": {"name": "part0.bin", "proof": json.dumps(created["proofs"]["part0.bin"]),
+                         "root": created["manifest"]["root"], "signature": created["signature"],
+                         "key_id": key_id}}
+
+    async def key_register_setup(client, data):
+        return {"data": {"key": (await new_key(client))["public_key"]}}
+
+    async def key_get_setup(client, data):
+        return {"method": "GET", "url": f"/keys/{(await new_key(client))['key_id']}"}
+
+    async def key_delete_setup(client, data):
+        # Each call removes the key, so the public key is registered again
+        # (untimed) before every DELETE
+        public = (await new_key(client))["public_key"]
+
+        async def register():
+            entry = (await client.post("/keys/register", data={"key": public})).json()
+            return {"url": f"/keys/{entry['key_id']}", "params": {"delete_token": entry["delete_token"]}}
+        return {"method": "DELETE", "prepare": register}
+
+    def generate_keys_setup(algorithm, warm=None):
+        # warm: one pooled RSA pair is ready before every call (a pop);
+        # drained: the pool is empty, so every call generates (the fallback).
+        # The pool is filled untimed and left at size 0 for the call itself,
+        # so no refill competes with the timed request, or later cases, for
+        # the CPU.
+        from keypool import rsa_key_pool
+
+        async def settle():
+            if warm is not None:
+                rsa_key_pool.ready.clear()
+                if warm:
+                    rsa_key_pool.size = 1
+                    rsa_key_pool.start()
+                    await asyncio.gather(*list(rsa_key_pool.refilling), return_exceptions=True)
+                    if not rsa_key_pool.ready:
+                        raise RuntimeError("RSA key pool failed to refill")
+                rsa_key_pool.size = 0
+            return {}
+
+        async def setup(client, data):
+            return {"method": "GET", "params": {"algorithm": algorithm}, "prepare": settle}
+        return setup
+
+    pipeline_stages = json.dumps([{"op": "watermark", "text": "SecureVision"},
+                                  {"op": "stego", "message": message},
+                                  {"op": "encrypt", "password": PASSWORD}])
+
+    cases = [
+        ("stego", "/stego/hide", "image", image(message=message)),
+        ("stego", "/stego/extract", "image", encrypted("/stego/hide", "image", "image", message=message)),
+        ("stego", "/stego/v2/hide", "image", image(message=message, bits_per_channel="2")),
+        ("stego", "/stego/v2/extract", "image",
+         encrypted("/stego/v2/hide", "image", "image", message=message, bits_per_channel="2")),
+        ("stego", "/stego/capacity", "image", image()),
+        ("aes", "/encrypt/aes", "payload", upload("image", password=PASSWORD)),
+        ("aes", "/decrypt/aes", "payload", encrypted("/encrypt/aes", "image", password=PASSWORD)),
+        ("shuffle", "/encrypt/shuffle", "image", image(key=str(SHUFFLE_KEY))),
+        ("shuffle", "/decrypt/shuffle", "image",
+         encrypted("/encrypt/shuffle", "image", "image", key=str(SHUFFLE_KEY))),
+        ("scramble", "/encrypt/scramble", "image", image(key=str(SHUFFLE_KEY))),
+        ("scramble", "/decrypt/scramble", "image",
+         encrypted("/encrypt/scramble", "image", "image", key=str(SHUFFLE_KEY))),
+        ("gcm", "/encrypt/aes-gcm", "payload", upload(password=PASSWORD)),
+        ("gcm", "/encrypt/aes-gcm[parallel]", "payload", upload(password=PASSWORD, parallel="true")),
+        ("gcm", "/decrypt/aes-gcm", "payload", encrypted("/encrypt/aes-gcm", "file", password=PASSWORD)),
+        ("watermark", "/watermark", "image", image(text="SecureVision")),
+        ("watermark", "/watermark/batch", "image", images(text="SecureVision")),
+        ("hash", "/hash", "payload", upload()),
+        ("analyze", "/analyze", "payload", upload()),
+        ("analyze", "/analyze[image]", "image", upload()),
+        ("batch", "/batch/encrypt", "payload", files(password=PASSWORD)),
+        ("batch", "/batch/encrypt[aes]", "payload", files(password=PASSWORD, algorithm="aes")),
+        ("batch", "/batch/decrypt", "payload", batch_decrypt_setup),
+        ("manifest", "/manifest/create", "payload", manifest_create_setup),
+        ("manifest", "/manifest/proof", "payload", manifest_proof_setup),
+        ("manifest", "/manifest/verify", "payload", manifest_verify_setup),
+        ("keys", "/keys/register", None, key_register_setup),
+        ("keys", "/keys/{key_id}[get]", None, key_get_setup),
+        ("keys", "/keys/{key_id}[delete]", None, key_delete_setup),
+        ("pipeline", "/pipeline", "image", image("file", stages=pipeline_stages)),
+        ("attack", "/attack/tamper", "payload", upload()),
+    ]
+
+    for algorithm in signature_algorithms:
+        async def sign_setup(client, data, algorithm=algorithm):
+            keys = (await client.get("/signature/generate-keys", params={"algorithm": algorithm})).json()
+            return {"files": {"file": ("bench", data)}, "data": {"private_key": keys["private_key"]}}
+
+        async def verify_setup(client, data, algorithm=algorithm):
+            keys = (await client.get("/signature/generate-keys", params={"algorithm": algorithm})).json()
+            sig = await post(client, "/signature/sign", files={"file": ("bench", data)},
+                             data={"private_key": keys["private_key"]})
+            return {"files": {"file": ("bench", data), "signature_file": ("sig", sig)},
+                    "data": {"public_key": keys["public_key"]}}
+
+        cases.append(("signature", f"/signature/sign[{algorithm}]", "payload", sign_setup))
+        cases.append(("signature", f"/signature/verify[{algorithm}]", "payload", verify_setup))
+        cases.append(("keys", f"/keys/generate[{algorithm}]", None, form(algorithm=algorithm)))
+
+        if algorithm == "rsa":
+            cases.append(("signature", "/signature/generate-keys[rsa,drained]", None,
+                          generate_keys_setup(algorithm, warm=False)))
+            cases.append(("signature", "/signature/generate-keys[rsa,warm]", None,
+                          generate_keys_setup(algorithm, warm=True)))
+        else:
+            # EC keys bypass the pool
+            cases.append(("signature", f"/signature/generate-keys[{algorithm}]", None,
+                          generate_keys_setup(algorithm)))
+    return cases
+
+
+# ----------------------- Runner -----------------------
+
+def inputs_for(kind, sizes, payloads, seed):
+    if kind == "image":
+        for name in sizes:
+            yield name, lambda name=name: image_png(*IMAGE_SIZES[name], seed=seed)
+    elif kind == "payload":
+        for text in payloads:
+            yield text, lambda text=text: payload(parse_size(text), seed)
+    else:
+        yield "-", lambda: b""
+
+
+def report(case, result):
+    throughput = f"{result['throughput_mb_s']:9.1f} MB/s" if result["throughput_mb_s"] else " " * 14
+    print(f"{case:<62} p50 {result['p50_ms']:10.2f} ms  p99 {result['p99_ms']:10.2f} ms "
+          f"{throughput}  rss {result['peak_rss_mb']:8.1f} MB", flush=True)
+
+
+def run_functions(args, message, groups, results):
+    cache = {}
+    for group, name, kind, setup in function_cases(message, args.signature_algorithms):
+        if group not in groups:
+            continue
+        for label, make in inputs_for(kind, args.sizes, args.payloads, args.seed):
+            if (kind, label) not in cache:
+                cache.clear()  # one input in memory at a time
+                cache[(kind, label)] = make()
+            data = cache[(kind, label)]
+            case = f"fn:{name}:{label}"
+            try:
+                results[case] = measure(setup(data), len(data), args.repeat, args.max_seconds)
+            except Exception as e:
+                results[case] = {"error": f"{type(e).__name__}: {e}"}
+                print(f"{case:<62} ERROR {results[case]['error']}")
+                continue
+            report(case, results[case])
+
+
+async def run_routes(args, message, groups, results):
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        cache = {}
+        for group, path, kind, setup in route_cases(message, args.signature_algorithms):
+            if group not in groups:
+                continue
+            for label, make in inputs_for(kind, args.sizes, args.payloads, args.seed):
+                if (kind, label) not in cache:
+                    cache.clear()
+                    cache[(kind, label)] = make()
+                data = cache[(kind, label)]
+                case = f"route:{path}:{label}"
+                try:
+                    request = await setup(client, data)
+                    method = request.pop("method", "POST")
+                    nbytes = request.pop("nbytes", len(data))
+                    prepare = request.pop("prepare", None)
+
+                    async def call(extra={}):
+                        kwargs = {"url": path.split("[")[0], **request, **extra}
+                        response = await client.request(method, **kwargs)
+                        if response.status_code != 200:
+                            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+                    results[case] = await ameasure(call, nbytes, args.repeat, args.max_seconds,
+                                                   prepare=prepare)
+                except Exception as e:
+                    results[case] = {"error": f"{type(e).__name__}: {e}"}
+                    print(f"{case:<62} ERROR {results[case]['error']}")
+                    continue
+                report(case, results[case])
+
+
+def print_comparison(baseline, current, threshold, rss_threshold):
+    regressions, improvements = compare(baseline, current, threshold, rss_threshold)
+    for title, rows in (("Improvements", improvements), ("REGRESSIONS", regressions)):
+        if rows:
+            print(f"\n{title}:")
+            for case, metric, old, new, change in rows:
+                print(f"  {case:<62} {metric:<12} {old:10.2f} -> {new:10.2f} ({change:+.0%})")
+    if not regressions:
+        print(f"\nNo regressions beyond {threshold:.0%} latency / {rss_threshold:.0%} RSS "
+              f"across {len(set(baseline) & set(current))} shared cases.")
+    return 1 if regressions else 0
+
+
+def csv(text):
+    return [part.strip() for part in text.split(",") if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="\n".join(__doc__.splitlines()[2:]))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--sizes", type=csv, default=list(DEFAULT_IMAGE_SIZES),
+                     help=f"image sizes ({', '.join(IMAGE_SIZES)})")
+    run.add_argument("--payloads", type=csv, default=list(DEFAULT_PAYLOADS), help="payload sizes, e.g. 1K,1M,1G")
+    run.add_argument("--only", type=csv, default=list(GROUPS), help=f"groups ({', '.join(GROUPS)})")
+    run.add_argument("--signature-algorithms", type=csv, default=["rsa", "ed25519", "ecdsa-p256"])
+    run.add_argument("--no-functions", action="store_true")
+    run.add_argument("--no-routes", action="store_true")
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--max-seconds", type=float, default=10.0,
+                     help="stop repeating a case after this long (it still runs at least once)")
+    run.add_argument("--message-chars", type=int, default=1024)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("-o", "--output", default="bench.json")
+    run.add_argument("--baseline", help="compare against this results file afterwards")
+    run.add_argument("--threshold", type=float, default=0.10)
+    run.add_argument("--rss-threshold", type=float, default=0.25)
+
+    cmp = commands.add_parser("compare", help="compare two results files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=0.10)
+    cmp.add_argument("--rss-threshold", type=float, default=0.25)
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        return print_comparison(load(args.baseline), load(args.current), args.threshold, args.rss_threshold)
+
+    unknown = [s for s in args.sizes if s not in IMAGE_SIZES] + [g for g in args.only if g not in GROUPS]
+    if unknown:
+        parser.error(f"unknown size/group: {', '.join(unknown)}")
+
+    # Routes are measured cold: no result cache hits and no key pre-generation
+    # competing for the CPU in the background
+    os.environ.setdefault("SV_RESULT_CACHE_BYTES", "0")
+    os.environ.setdefault("SV_RSA_KEY_POOL_SIZE", "0")
+
+    message = text_message(args.message_chars, args.seed)
+    results = {}
+    try:
+        if not args.no_functions:
+            run_functions(args, message, set(args.only), results)
+        if not args.no_routes:
+            asyncio.run(run_routes(args, message, set(args.only), results))
+    finally:
+        for path in TEMP_FILES:
+            os.remove(path)
+
+    save(results, args.output)
+    print(f"\nWrote {len(results)} cases to {args.output}")
+    if args.baseline:
+        return print_comparison(load(args.baseline), results, args.threshold, args.rss_threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
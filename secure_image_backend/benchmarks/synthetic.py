@@ -0,0 +1,93 @@
+"""Deterministic synthetic inputs for the benchmark suite.
+
+Images are smooth gradients plus a sine pattern and low-amplitude noise, so
+they compress like photographs rather than like pure noise (a noise 8K PNG
+is ~100 MB and would benchmark zlib more than our code). Everything is
+seeded, and encoded PNGs are cached on disk because large ones take seconds
+to produce.
+"""
+from PIL import Image
+import numpy as np
+import os
+import io
+
+SYNTHETIC_VERSION = 1
+
+IMAGE_SIZES = {
+    "256": (256, 256),
+    "512": (512, 512),
+    "1k": (1024, 1024),
+    "2k": (2048, 2048),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+    "16k": (15360, 8640),
+}
+DEFAULT_IMAGE_SIZES = ("256", "1k", "2k")
+
+PAYLOAD_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+DEFAULT_PAYLOADS = ("1K", "1M", "16M")
+
+CACHE_DIR = os.environ.get("SV_BENCH_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "securevision-bench"))
+
+
+def parse_size(text):
+    # "1K" / "64M" / "1G" / "4096" -> bytes
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in PAYLOAD_UNITS:
+        return int(float(text[:-1]) * PAYLOAD_UNITS[text[-1]])
+    return int(text)
+
+
+def image_array(width, height, seed=0):
+    rng = np.random.default_rng([seed, width, height])
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    wave = np.sin(x * 23.0 + y * 17.0) * 40
+
+    out = np.empty((height, width, 3), dtype=np.uint8)
+    for channel, (a, b) in enumerate(((180, 40), (60, 150), (120, 90))):
+        # One channel at a time keeps the float temporaries to one plane
+        plane = a * x + b * y + wave + rng.normal(0, 6, size=(height, width)).astype(np.float32)
+        np.clip(plane, 0, 255, out=plane)
+        out[:, :, channel] = plane
+    return out
+
+
+def image_png(width, height, seed=0, cache_dir=CACHE_DIR):
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, f"img-v{SYNTHETIC_VERSION}-{width}x{height}-{seed}.png")
+        if os.path.exists(path):
+            with open(path, "rb") as fp:
+                return fp.read()
+
+    buffer = io.BytesIO()
+    Image.fromarray(image_array(width, height, seed), "RGB").save(buffer, format="PNG")
+    data = buffer.getvalue()
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+    return data
+
+
+def payload(size, seed=0):
+    # Incompressible bytes, generated in 64 MiB pieces so 1 GB payloads
+    # don't need a second full-size temporary
+    rng = np.random.default_rng([seed, size])
+    out = bytearray(size)
+    step = 64 * 1024 * 1024
+    for start in range(0, size, step):
+        n = min(step, size - start)
+        out[start:start + n] = rng.integers(0, 256, size=n, dtype=np.uint8).tobytes()
+    return bytes(out)
+
+
+def text_message(chars, seed=0):
+    rng = np.random.default_rng([seed, chars])
+    alphabet = np.frombuffer(b"abcdefghijklmnopqrstuvwxyz0123456789 ", dtype=np.uint8)
+    return rng.choice(alphabet, size=chars).tobytes().decode()
@@ -1,38 +1,120 @@
 from Crypto.Cipher import AES
-from Crypto.Protocol.KDF import PBKDF2
 from PIL import Image
 import numpy as np
 import io
 
+from encryption import (row_permutation, shuffle_rows_to, block_permutations, permute_tiles,
+                        derive_aes_key, BLOCK_SIZE, CBC_MAGIC)
+from metrics import stage
+
+
+def strip_padding(block):
+    n = block[-1] if block else 0
+    if not 1 <= n <= BLOCK_SIZE or block[-n:] != bytes([n]) * n:
+        raise ValueError("Invalid PKCS#7 padding")
+    return block[:-n]
+
+
+class CBCStreamDecryptor:
+    # Mirror of CBCStreamEncryptor: the last block is held back until
+    # finalize(), since only then is it known to carry the padding.
+    # Only files starting with CBC_MAGIC are PKCS#7 padded; legacy files
+    # (bare iv | ciphertext, space padded) decrypt exactly as they always
+    # did, padding included. A legacy IV has a 2^-40 chance of looking
+    # like the marker.
+    def __init__(self, key):
+        self.key = key
+        self.cipher = None
+        self.padded = None
+        self.pending = b""
+
+    def update(self, data):
+        if self.pending:
+            data = self.pending + data
+        if self.cipher is None:
+            if len(data) < len(CBC_MAGIC):
+                self.pending = bytes(data)
+                return b""
+            padded = data[:len(CBC_MAGIC)] == CBC_MAGIC
+            start = len(CBC_MAGIC) if padded else 0
+            if len(data) < start + BLOCK_SIZE:
+                self.pending = bytes(data)
+                return b""
+            self.padded = padded
+            self.cipher = AES.new(self.key, AES.MODE_CBC, iv=bytes(data[start:start + BLOCK_SIZE]))
+            data = memoryview(data)[start + BLOCK_SIZE:]
+
+        cut = max(0, (len(data) - 1) // BLOCK_SIZE * BLOCK_SIZE)
+        self.pending = bytes(data[cut:])
+        if not cut:
+            return b""
+        with stage("cipher"):
+            return self.cipher.decrypt(memoryview(data)[:cut])
+
+    def finalize(self):
+        if self.cipher is None:
+            raise ValueError("Ciphertext is missing its IV")
+        if len(self.pending) % BLOCK_SIZE:
+            raise ValueError("Ciphertext is not a multiple of the AES block size")
+        if not self.pending:
+            if self.padded:
+                raise ValueError("Ciphertext is missing its padding block")
+            return b""
+        with stage("cipher"):
+            block = self.cipher.decrypt(self.pending)
+        return strip_padding(block) if self.padded else block
+
 
 def decrypt_image_aes(enc_data, password):
-    key = PBKDF2(password, b"salt_123", dkLen=32)
+    key = derive_aes_key(password)
 
-    iv = enc_data[:16]
-    cipher = AES.new(key, AES.MODE_CBC, iv=iv)
+    return decrypt_image_aes_with_key(enc_data, key)
 
-    decrypted = cipher.decrypt(enc_data[16:])
-    return decrypted
 
+def decrypt_image_aes_with_key(enc_data, key):
+    decryptor = CBCStreamDecryptor(key)
+    return decryptor.update(enc_data) + decryptor.finalize()
 
-def decrypt_image_shuffle(image_bytes, key):
+
+def decrypt_image_shuffle(image_bytes, key, rng="legacy"):
     image = Image.open(io.BytesIO(image_bytes))
-    arr = np.array(image)
-    
-    # 1. Generate the SAME shuffled indices using the SAME key
-    indices = np.arange(arr.shape[0])
-    np.random.seed(key)
-    np.random.shuffle(indices)
     
-    # 2. Find the "Inverse" mapping
-    # This tells us: "The row that is now at position X belongs at position Y"
-    unshuffle_map = np.zeros_like(indices)
-    unshuffle_map[indices] = np.arange(len(indices))
+    # 1. Look up the SAME permutation and its "Inverse" mapping for this key.
+    # The inverse tells us: "The row that is now at position X belongs at position Y"
+    _, unshuffle_map = row_permutation(key, image.size[1], rng)
     
-    # 3. Apply the inverse map to restore original row order
-    decrypted_arr = arr[unshuffle_map]
-    
-    out = Image.fromarray(decrypted_arr)
-    buffer = io.BytesIO()
-    out.save(buffer, format="PNG")
+    # 2. Write the rows back out in original order, one band at a time
+    return shuffle_rows_to(image, unshuffle_map, io.BytesIO()).getvalue()
+
+
+def decrypt_image_shuffle_file(src_path, dst_path, key, rng="legacy"):
+    with Image.open(src_path) as image, open(dst_path, "wb") as fp:
+        _, unshuffle_map = row_permutation(key, image.size[1], rng)
+        shuffle_rows_to(image, unshuffle_map, fp)
+
+
+def unscramble_array(arr, key, block=16, inner=True):
+    if block < 2:
+        raise ValueError("block must be at least 2")
+    h, w = arr.shape[:2]
+    n_tiles = (h // block) * (w // block)
+    if n_tiles == 0:
+        return arr.copy()
+
+    # The inverse of a tile/row/column permutation is the same gather with
+    # the inverse permutations
+    (_, tiles_inv), (_, rows_inv), (_, cols_inv) = block_permutations(key, n_tiles, block, inner)
+    return permute_tiles(arr, tiles_inv, rows_inv, cols_inv, block)
+
+
+def decrypt_image_scramble(image_bytes, key, block=16, inner=True):
+    with stage("decode"):
+        image = Image.open(io.BytesIO(image_bytes))
+        arr = np.array(image)
+
+    with stage("scramble"):
+        out = Image.fromarray(unscramble_array(arr, key, block, inner))
+    with stage("png_encode"):
+        buffer = io.BytesIO()
+        out.save(buffer, format="PNG")
     return buffer.getvalue()
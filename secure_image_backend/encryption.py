@@ -2,42 +2,219 @@ from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Protocol.KDF import PBKDF2
 from PIL import Image
+from functools import lru_cache
 import numpy as np
 import io
 import base64
 
+from png_stream import can_stream, write_rows_in_order
+from metrics import stage
 
-def pad(data):
-    while len(data) % 16 != 0:
-        data += b" "
-    return data
+
+BLOCK_SIZE = 16
+# Files written since PKCS#7 padding start with this marker; legacy files
+# (space padded) are a bare iv | ciphertext.
+CBC_MAGIC = b"SVCB\x01"
+
+
+def pkcs7_pad(tail):
+    # Padding for the final (< BLOCK_SIZE byte) remainder only; the rest of
+    # the stream is never copied to pad it.
+    n = BLOCK_SIZE - len(tail) % BLOCK_SIZE
+    return bytes(tail) + bytes([n]) * n
+
+
+def derive_aes_key(password):
+    with stage("kdf"):
+        return PBKDF2(password, b"salt_123", dkLen=32)
+
+
+class CBCStreamEncryptor:
+    """AES-CBC over a stream: CBC_MAGIC | iv | ciphertext, PKCS#7 padded.
+
+    update() encrypts every whole block it is given and keeps back at most
+    15 bytes, so memory stays at one chunk however large the upload is.
+    """
+
+    def __init__(self, key, iv=None):
+        self.cipher = AES.new(key, AES.MODE_CBC, iv=iv)
+        self.header = CBC_MAGIC + self.cipher.iv
+        self.tail = b""
+
+    def update(self, data):
+        if self.tail:
+            data = self.tail + data
+        cut = len(data) - len(data) % BLOCK_SIZE
+        self.tail = bytes(data[cut:])
+        if not cut:
+            return b""
+        with stage("cipher"):
+            return self.cipher.encrypt(memoryview(data)[:cut])
+
+    def finalize(self):
+        with stage("cipher"):
+            return self.cipher.encrypt(pkcs7_pad(self.tail))
 
 
 def encrypt_image_aes(image_bytes, password):
 
-    key = PBKDF2(password, b"salt_123", dkLen=32)
+    key = derive_aes_key(password)
+
+    return encrypt_image_aes_with_key(image_bytes, key)
+
+
+def encrypt_image_aes_with_key(image_bytes, key):
+    encryptor = CBCStreamEncryptor(key)
+    return encryptor.header + encryptor.update(image_bytes) + encryptor.finalize()
+
+
+SHUFFLE_RNGS = ("legacy", "pcg64")
+
+
+@lru_cache(maxsize=128)
+def row_permutation(key, height, rng="legacy"):
+    """Return (permutation, inverse) of range(height) for a shuffle key.
+
+    "legacy" reproduces np.random.seed(key) + np.random.shuffle on a private
+    RandomState, so images shuffled by earlier versions still decrypt;
+    "pcg64" uses a local np.random.Generator. Neither touches the global
+    NumPy random state, and the cached arrays are read-only so they can be
+    shared across threads.
+    """
+    if rng == "legacy":
+        indices = np.arange(height)
+        np.random.RandomState(key).shuffle(indices)
+    elif rng == "pcg64":
+        indices = np.random.default_rng(key).permutation(height)
+    else:
+        raise ValueError(f"rng must be one of {', '.join(SHUFFLE_RNGS)}")
+
+    inverse = np.empty_like(indices)
+    inverse[indices] = np.arange(height)
+
+    indices.setflags(write=False)
+    inverse.setflags(write=False)
+    return indices, inverse
+
 
-    cipher = AES.new(key, AES.MODE_CBC)
-    encrypted = cipher.encrypt(pad(image_bytes))
+def shuffle_rows_to(image, order, fp):
+    # Write image to fp as a PNG with row i taken from source row order[i]
+    with stage("decode"):
+        image.load()
+    with stage("png_encode"):
+        if can_stream(image.mode):
+            return write_rows_in_order(image, order, fp)
 
-    return cipher.iv + encrypted
+        # Modes the streaming encoder doesn't cover go through a full copy
+        out = Image.fromarray(np.array(image)[order])
+        out.save(fp, format="PNG")
+    return fp
 
 
-def encrypt_image_shuffle(image_bytes, key):
+def encrypt_image_shuffle(image_bytes, key, rng="legacy"):
     image = Image.open(io.BytesIO(image_bytes))
-    arr = np.array(image)
     
-    # 1. Create a list of row indices [0, 1, 2, ..., height-1]
-    indices = np.arange(arr.shape[0])
+    # 1. Look up the row order for this key and height (cached per pair)
+    indices, _ = row_permutation(key, image.size[1], rng)
     
-    # 2. Shuffle those indices using the secret key
-    np.random.seed(key)
-    np.random.shuffle(indices)
-    
-    # 3. Reorder the image rows based on shuffled indices
-    shuffled_arr = arr[indices]
-    
-    out = Image.fromarray(shuffled_arr)
-    buffer = io.BytesIO()
-    out.save(buffer, format="PNG")
+    # 2. Write the rows out in shuffled order, one band at a time
+    return shuffle_rows_to(image, indices, io.BytesIO()).getvalue()
+
+
+def encrypt_image_shuffle_file(src_path, dst_path, key, rng="legacy"):
+    # File-to-file variant for very large images: the decoded source is the
+    # only full raster in memory and the PNG is written straight to disk.
+    with Image.open(src_path) as image, open(dst_path, "wb") as fp:
+        indices, _ = row_permutation(key, image.size[1], rng)
+        shuffle_rows_to(image, indices, fp)
+
+
+# ----------------------- Block scrambling -----------------------
+#
+# The image is cut into block x block tiles which are permuted as a whole;
+# with inner=True the rows and columns inside every tile are permuted too.
+# A tile row of one tile is a contiguous run of block pixels, so tile and
+# inner-row permutation collapse into a single np.take over those runs;
+# the column permutation is one more take within each run. Edge strips
+# narrower than one tile are left in place.
+
+def _inverse(perm):
+    inverse = np.empty_like(perm)
+    inverse[perm] = np.arange(len(perm))
+    inverse.setflags(write=False)
+    perm.setflags(write=False)
+    return inverse
+
+
+@lru_cache(maxsize=128)
+def block_permutations(key, n_tiles, block, inner=True):
+    """Return ((tiles, tiles_inv), (rows, rows_inv), (cols, cols_inv)) for a key.
+
+    Without inner scrambling the row and column permutations are identities.
+    """
+    rng = np.random.default_rng([key, block])
+    tiles = rng.permutation(n_tiles)
+    perms = [(tiles, _inverse(tiles))]
+    for _ in range(2):
+        perm = rng.permutation(block) if inner else np.arange(block)
+        perms.append((perm, _inverse(perm)))
+    return tuple(perms)
+
+
+def permute_tiles(arr, tiles, rows, cols, block):
+    """Return a copy of arr with tile i of the output taken from tile tiles[i],
+    and within it row r / column c taken from rows[r] / cols[c]."""
+    h, w = arr.shape[:2]
+    nby, nbx = h // block, w // block
+    channels = arr[0, 0].size
+
+    # Source run for every (tile row, row in tile, tile col) of the output
+    ty = (tiles // nbx).reshape(nby, 1, nbx)
+    tx = (tiles % nbx).reshape(nby, 1, nbx)
+    runs = ((ty * block + rows.reshape(1, block, 1)) * nbx + tx).reshape(-1)
+
+    src = np.ascontiguousarray(arr[:nby * block, :nbx * block]).reshape(-1, block * channels)
+    # Only the untiled edge strips are copied over unchanged
+    out = np.empty_like(arr)
+    out[nby * block:] = arr[nby * block:]
+    out[:nby * block, nbx * block:] = arr[:nby * block, nbx * block:]
+    core = out[:nby * block, :nbx * block]
+    contiguous = core.flags.c_contiguous
+    dst = core.reshape(-1, block * channels) if contiguous else None
+
+    # mode="clip" lets take write straight into out without buffering;
+    # every index is in range anyway
+    if np.array_equal(cols, np.arange(block)):
+        dst = np.take(src, runs, axis=0, out=dst, mode="clip")
+    else:
+        lanes = (cols.reshape(-1, 1) * channels + np.arange(channels)).reshape(-1)
+        dst = np.take(src.take(runs, axis=0), lanes, axis=1, out=dst, mode="clip")
+
+    if not contiguous:
+        core[...] = dst.reshape(core.shape)
+    return out
+
+
+def scramble_array(arr, key, block=16, inner=True):
+    if block < 2:
+        raise ValueError("block must be at least 2")
+    h, w = arr.shape[:2]
+    n_tiles = (h // block) * (w // block)
+    if n_tiles == 0:
+        return arr.copy()
+
+    (tiles, _), (rows, _), (cols, _) = block_permutations(key, n_tiles, block, inner)
+    return permute_tiles(arr, tiles, rows, cols, block)
+
+
+def encrypt_image_scramble(image_bytes, key, block=16, inner=True):
+    with stage("decode"):
+        image = Image.open(io.BytesIO(image_bytes))
+        arr = np.array(image)
+
+    with stage("scramble"):
+        out = Image.fromarray(scramble_array(arr, key, block, inner))
+    with stage("png_encode"):
+        buffer = io.BytesIO()
+        out.save(buffer, format="PNG")
     return buffer.getvalue()
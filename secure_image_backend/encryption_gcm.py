@@ -1,14 +1,199 @@
-from Crypto.Cipher import AES
-from Crypto.Protocol.KDF import PBKDF2
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+from Crypto.Protocol.KDF import PBKDF2, HKDF
 from Crypto.Random import get_random_bytes
+from Crypto.Hash import SHA256
+from collections import OrderedDict
+import threading
+import secrets
+import hashlib
+import hmac
+import time
+import os
 
+from metrics import stage
 
-def encrypt_aes_gcm(data: bytes, password: str):
-    salt = get_random_bytes(16)
-    key = PBKDF2(password, salt, dkLen=32, count=200000)
 
-    cipher = AES.new(key, AES.MODE_GCM)
-    ciphertext, tag = cipher.encrypt_and_digest(data)
+KDF_ITERATIONS = 200000
+KEY_CACHE_SIZE = 256
+KEY_CACHE_TTL = 600
+# Sessions expire after SESSION_TTL seconds without use
+SESSION_TTL = int(os.environ.get("SV_GCM_SESSION_TTL", 600))
+MAX_SESSIONS = int(os.environ.get("SV_GCM_MAX_SESSIONS", 1024))
+MAX_SESSION_PASSWORDS = 64
+
+
+class DerivedKeyCache:
+    """Bounded LRU of PBKDF2 outputs with TTL expiry.
+
+    Entries are keyed by HMAC(process secret, salt | password), so neither the
+    password nor an unkeyed hash of it is ever held in memory.
+    """
+
+    def __init__(self, maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.secret = get_random_bytes(32)
+        self.keys = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fingerprint(self, password, salt=b""):
+        return hmac.new(self.secret, salt + password.encode(), hashlib.sha256).digest()
+
+    def _get(self, table, name, now):
+        entry = table.get(name)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < now:
+            del table[name]
+            return None
+        table.move_to_end(name)
+        return value
+
+    def _put(self, table, name, value, now):
+        table[name] = (value, now + self.ttl)
+        table.move_to_end(name)
+        while len(table) > self.maxsize:
+            table.popitem(last=False)
+
+    def derive(self, password: str, salt: bytes):
+        name = self._fingerprint(password, salt)
+        while True:
+            with self.lock:
+                key = self._get(self.keys, name, time.monotonic())
+                if key is not None:
+                    self.hits += 1
+                    return key
+                pending = self.inflight.get(name)
+                if pending is None:
+                    self.misses += 1
+                    pending = self.inflight[name] = threading.Event()
+                    break
+            # Another thread is already deriving this key (e.g. parallel batch
+            # entries sharing a salt); wait for it instead of repeating the KDF.
+            pending.wait()
+
+        try:
+            with stage("kdf"):
+                key = PBKDF2(password, salt, dkLen=32, count=KDF_ITERATIONS)
+            with self.lock:
+                self._put(self.keys, name, key, time.monotonic())
+            return key
+        finally:
+            with self.lock:
+                del self.inflight[name]
+            pending.set()
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.keys),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+            }
+
+
+key_cache = DerivedKeyCache()
+
+
+class SessionLimitError(RuntimeError):
+    pass
+
+
+class SessionStore:
+    """Explicitly opened encryption sessions, each with one salt per password.
+
+    Sessions are opt-in: a client opens one and passes the token with each
+    upload. Salts are scoped to (token, password), so uploads in different
+    sessions never share a salt even under the same password. The store is
+    bounded on its own: when full, new sessions are refused rather than
+    evicting live ones, and every use pushes a session's expiry back.
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, max_passwords=MAX_SESSION_PASSWORDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_passwords = max_passwords
+        self.secret = get_random_bytes(32)
+        self.sessions = {}          # token -> [salts by password fingerprint, expiry]
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def _expire(self, now):
+        for token in [t for t, (_, expires) in self.sessions.items() if expires < now]:
+            del self.sessions[token]
+
+    def open(self):
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            now = time.monotonic()
+            if len(self.sessions) >= self.max_sessions:
+                self._expire(now)
+            if len(self.sessions) >= self.max_sessions:
+                self.rejected += 1
+                raise SessionLimitError("Too many open sessions, try again later")
+            self.sessions[token] = [{}, now + self.ttl]
+        return token
+
+    def salt(self, password: str, session: str):
+        # Reuse one salt per password for the lifetime of the session, so
+        # every encryption in it hits the cached key.
+        name = hmac.new(self.secret, password.encode(), hashlib.sha256).digest()
+        with self.lock:
+            now = time.monotonic()
+            entry = self.sessions.get(session)
+            if entry is None or entry[1] < now:
+                self.sessions.pop(session, None)
+                raise ValueError("Unknown or expired session")
+            entry[1] = now + self.ttl
+            salts = entry[0]
+            salt = salts.get(name)
+            if salt is None:
+                if len(salts) >= self.max_passwords:
+                    raise ValueError("Too many passwords in one session")
+                salt = salts[name] = get_random_bytes(16)
+            return salt
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "open": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "rejected": self.rejected,
+                "ttl_seconds": self.ttl,
+            }
+
+
+session_store = SessionStore()
+
+
+def encrypt_aes_gcm(data: bytes, password: str, session: str = None):
+    # Within a session the key is shared; each message still gets a random
+    # 16-byte nonce.
+    salt = session_store.salt(password, session) if session else get_random_bytes(16)
+    key = key_cache.derive(password, salt)
+    return encrypt_aes_gcm_with_key(data, key, salt)
+
+
+def encrypt_aes_gcm_with_key(data: bytes, key: bytes, salt: bytes):
+    # Same container as encrypt_aes_gcm, for callers that derived the key
+    # themselves (e.g. once for a whole batch).
+    with stage("cipher"):
+        cipher = AES.new(key, AES.MODE_GCM)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
 
     return salt + cipher.nonce + tag + ciphertext
 
@@ -19,7 +204,302 @@ def decrypt_aes_gcm(enc: bytes, password: str):
     tag = enc[32:48]
     ciphertext = enc[48:]
 
-    key = PBKDF2(password, salt, dkLen=32, count=200000)
+    key = key_cache.derive(password, salt)
+
+    with stage("cipher"):
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+
+# ----------------------- Streaming (segmented) container -----------------------
+#
+# v1 header : magic(4) | version(1) | record_size(4) | salt(16) | nonce_prefix(7)
+# v2 header : magic(4) | version(1) | aead(1) | record_size(4) | salt(16) | nonce_prefix(7)
+# v3 header : same layout as v2
+# record    : ciphertext(<= record_size) | tag(16)
+#
+# Each record is sealed under nonce_prefix | counter(4) | final(1), with the
+# header as associated data. v1 and v2 seal records with the PBKDF2 key
+# itself; v3 uses a per-stream subkey, HKDF(key, salt | nonce_prefix). Every record except the last holds exactly
+# record_size bytes; the last one is shorter (possibly empty) and carries the
+# final flag, so truncating or reordering records fails authentication.
+# v1 containers are always AES-GCM; v2 records the AEAD in the header.
+
+STREAM_MAGIC = b"SVGS"
+STREAM_VERSION = 3
+HEADER_SIZES = {1: 32, 2: 33, 3: 33}
+DEFAULT_RECORD_SIZE = 64 * 1024
+# Parallel mode seals larger segments so each pool task amortises its
+# dispatch overhead; containers with segments at least PARALLEL_MIN_SEGMENT
+# are also decrypted in parallel.
+PARALLEL_SEGMENT_SIZE = 1024 * 1024
+PARALLEL_MIN_SEGMENT = 256 * 1024
+MAX_RECORD_SIZE = 64 * 1024 * 1024
+TAG_SIZE = 16
+
+AEADS = {"aes-gcm": 1, "chacha20-poly1305": 2}
+AEAD_NAMES = {v: k for k, v in AEADS.items()}
+DEFAULT_AEAD = os.environ.get("SV_DEFAULT_AEAD", "aes-gcm")
+
+
+def _new_aead(algorithm, key, nonce):
+    if algorithm == "chacha20-poly1305":
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce)
+    return AES.new(key, AES.MODE_GCM, nonce=nonce)
+
+
+# "auto" picks whichever AEAD is faster on this host. Without AES-NI (or
+# with a pycryptodome build that doesn't use it) ChaCha20-Poly1305 usually
+# wins; with it, AES-GCM does.
+_selection = {}
+_selection_lock = threading.Lock()
+
+
+def benchmark_aeads(size=1024 * 1024, rounds=5):
+    data = get_random_bytes(size)
+    key = get_random_bytes(32)
+    results = {}
+    for algorithm in AEADS:
+        best = float("inf")
+        for i in range(rounds):
+            cipher = _new_aead(algorithm, key, i.to_bytes(12, "big"))
+            start = time.perf_counter()
+            cipher.encrypt_and_digest(data)
+            best = min(best, time.perf_counter() - start)
+        results[algorithm] = round(size / best / 1e6, 1)
+    return results
+
+
+def select_aead():
+    with _selection_lock:
+        if not _selection:
+            throughput = benchmark_aeads()
+            _selection["throughput_mb_s"] = throughput
+            _selection["selected"] = max(throughput, key=throughput.get)
+        return dict(_selection)
+
+
+def resolve_aead(algorithm=None):
+    algorithm = algorithm or DEFAULT_AEAD
+    if algorithm == "auto":
+        return select_aead()["selected"]
+    if algorithm not in AEADS:
+        raise ValueError(f"Unsupported AEAD '{algorithm}'. Choose from {', '.join(AEADS)} or auto")
+    return algorithm
+
+
+def stream_key(key: bytes, salt: bytes, prefix: bytes):
+    # Streams sharing a salt (and so a cached PBKDF2 key) still seal their
+    # records under distinct keys.
+    return HKDF(key, 32, salt + prefix, SHA256, context=STREAM_MAGIC + b"v3")
+
+
+def _record_nonce(prefix: bytes, counter: int, final: bool):
+    if counter >= 1 << 32:
+        raise ValueError("Stream too long for a single container")
+    return prefix + counter.to_bytes(4, "big") + (b"\x01" if final else b"\x00")
+
+
+class SegmentError(ValueError):
+    def __init__(self, segment):
+        super().__init__(f"Segment {segment} failed authentication")
+        self.segment = segment
+
+
+# Records are independent once the header is known: each has its own nonce
+# and tag. Sealing and opening therefore work on (counter, final, data) jobs
+# with a context of (algorithm, key, header, prefix), so a caller can spread
+# the jobs of one stream over a pool and join the results in order.
+
+def seal_record(context, job):
+    algorithm, key, header, prefix = context
+    counter, final, chunk = job
+    cipher = _new_aead(algorithm, key, _record_nonce(prefix, counter, final))
+    cipher.update(header)
+    ciphertext, tag = cipher.encrypt_and_digest(chunk)
+    return ciphertext + tag
+
+
+def open_record(context, job):
+    algorithm, key, header, prefix = context
+    counter, final, record = job
+    cipher = _new_aead(algorithm, key, _record_nonce(prefix, counter, final))
+    cipher.update(header)
+    try:
+        return cipher.decrypt_and_verify(record[:-TAG_SIZE], record[-TAG_SIZE:])
+    except ValueError:
+        raise SegmentError(counter) from None
+
+
+def process_records(func, context, jobs):
+    with stage("cipher"):
+        return b"".join(func(context, job) for job in jobs)
+
+
+class GCMStreamEncryptor:
+    """Streaming encryptor for the segmented container.
+
+    Despite the name it is cipher-agile: algorithm is "aes-gcm",
+    "chacha20-poly1305" or "auto". Passing salt reuses a caller-chosen salt
+    (and so the cached PBKDF2 key), e.g. across the entries of one batch or
+    one session.
+    """
+
+    def __init__(self, password: str, record_size: int = DEFAULT_RECORD_SIZE,
+                 algorithm: str = None, salt: bytes = None):
+        # A shared salt means a shared PBKDF2 key, so records are sealed
+        # under a subkey derived from it and this stream's random prefix.
+        if not 0 < record_size <= MAX_RECORD_SIZE:
+            raise ValueError(f"Segment size must be between 1 and {MAX_RECORD_SIZE} bytes")
+        self.algorithm = resolve_aead(algorithm)
+        if salt is None:
+            salt = get_random_bytes(16)
+        prefix = get_random_bytes(7)
+        key = stream_key(key_cache.derive(password, salt), salt, prefix)
+        self.record_size = record_size
+        self.header = (STREAM_MAGIC + bytes([STREAM_VERSION, AEADS[self.algorithm]]) +
+                       record_size.to_bytes(4, "big") + salt + prefix)
+        self.context = (self.algorithm, key, self.header, prefix)
+        self.counter = 0
+        self.pending = bytearray()
+
+    def _job(self, chunk, final):
+        if self.counter >= 1 << 32:
+            raise ValueError("Stream too long for a single container")
+        job = (self.counter, final, chunk)
+        self.counter += 1
+        return job
+
+    def split(self, data: bytes):
+        # Jobs for every full record available; the remainder waits for more
+        # data. A full record is held back until more data arrives, since it
+        # might turn out to be the last one.
+        self.pending += data
+        jobs = []
+        pos = 0
+        while len(self.pending) - pos > self.record_size:
+            jobs.append(self._job(bytes(self.pending[pos:pos + self.record_size]), False))
+            pos += self.record_size
+        del self.pending[:pos]
+        return jobs
+
+    def split_final(self):
+        if len(self.pending) == self.record_size:
+            jobs = [self._job(bytes(self.pending), False), self._job(b"", True)]
+        else:
+            jobs = [self._job(bytes(self.pending), True)]
+        self.pending = bytearray()
+        return jobs
+
+    def update(self, data: bytes):
+        return process_records(seal_record, self.context, self.split(data))
+
+    def finalize(self):
+        return process_records(seal_record, self.context, self.split_final())
+
+
+class GCMStreamDecryptor:
+    def __init__(self, password: str):
+        self.password = password
+        self.header = None
+        self.context = None
+        self.counter = 0
+        self.done = False
+        self.pending = bytearray()
+
+    def _read_header(self):
+        # Returns False until the whole header has arrived
+        if len(self.pending) < 5:
+            return False
+        if self.pending[:4] != STREAM_MAGIC or self.pending[4] not in HEADER_SIZES:
+            raise ValueError("Not a streaming AES-GCM container")
+        size = HEADER_SIZES[self.pending[4]]
+        if len(self.pending) < size:
+            return False
+
+        header = bytes(self.pending[:size])
+        if header[4] == 1:
+            self.algorithm = "aes-gcm"
+            fields = header[5:]
+        else:
+            if header[5] not in AEAD_NAMES:
+                raise ValueError(f"Unknown AEAD id {header[5]}")
+            self.algorithm = AEAD_NAMES[header[5]]
+            fields = header[6:]
+        self.record_size = int.from_bytes(fields[:4], "big")
+        if not 0 < self.record_size <= MAX_RECORD_SIZE:
+            raise ValueError("Invalid segment size in header")
+        salt = fields[4:20]
+        prefix = fields[20:27]
+        key = key_cache.derive(self.password, salt)
+        if header[4] >= 3:
+            key = stream_key(key, salt, prefix)
+        self.header = header
+        self.context = (self.algorithm, key, header, prefix)
+        del self.pending[:size]
+        return True
+
+    def _job(self, record, final):
+        job = (self.counter, final, record)
+        self.counter += 1
+        return job
+
+    def split(self, data: bytes):
+        self.pending += data
+        if self.header is None and not self._read_header():
+            return []
+
+        # A full-size record is only known to be non-final once at least one
+        # more byte has arrived behind it.
+        full = self.record_size + TAG_SIZE
+        jobs = []
+        pos = 0
+        while len(self.pending) - pos > full:
+            jobs.append(self._job(bytes(self.pending[pos:pos + full]), False))
+            pos += full
+        del self.pending[:pos]
+        return jobs
+
+    def split_final(self):
+        if self.header is None:
+            raise ValueError("Truncated stream header")
+        if self.done:
+            return []
+
+        full = self.record_size + TAG_SIZE
+        jobs = []
+        if len(self.pending) == full:
+            jobs.append(self._job(bytes(self.pending), False))
+            self.pending = bytearray()
+        if len(self.pending) < TAG_SIZE:
+            raise ValueError("Stream truncated before final record")
+        jobs.append(self._job(bytes(self.pending), True))
+        self.pending = bytearray()
+        self.done = True
+        return jobs
+
+    def update(self, data: bytes):
+        jobs = self.split(data)
+        return process_records(open_record, self.context, jobs)
+
+    def finalize(self):
+        jobs = self.split_final()
+        return process_records(open_record, self.context, jobs)
+
+
+def is_stream_container(prefix: bytes):
+    return prefix[:4] == STREAM_MAGIC
+
+
+def encrypt_stream(data: bytes, password: str, algorithm: str = None, salt: bytes = None):
+    # Whole-buffer helper producing the streaming container
+    encryptor = GCMStreamEncryptor(password, algorithm=algorithm, salt=salt)
+    return encryptor.header + encryptor.update(data) + encryptor.finalize()
+
 
-    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
-    return cipher.decrypt_and_verify(ciphertext, tag)
+def decrypt_aes_gcm_any(enc: bytes, password: str):
+    # Decrypt a whole buffer in either the streaming or the single-shot format.
+    if not is_stream_container(enc):
+        return decrypt_aes_gcm(enc, password)
+    decryptor = GCMStreamDecryptor(password)
+    return decryptor.update(enc) + decryptor.finalize()
@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException
+import functools
+import asyncio
+import os
+
+from metrics import call_collecting, record_stage
+
+
+# Each operation type gets its own pool so a burst of one kind of work
+# (e.g. RSA key generation) cannot starve another (e.g. AES).
+#   image  : Pillow decode/encode and NumPy pixel work (holds the GIL)
+#   crypto : PBKDF2, AES, hashing, RSA sign/verify (pycryptodome and hashlib
+#            release the GIL, so threads scale)
+#   rsa    : RSA key generation (mostly pure Python)
+#   stream : per-request stateful objects such as streaming ciphers, and
+#            in-process state such as the signing-key registry; these can't
+#            be pickled across processes, so this pool is always threads
+CPU_COUNT = os.cpu_count() or 1
+
+POOL_DEFAULTS = {
+    "image": ("process", CPU_COUNT),
+    "crypto": ("thread", CPU_COUNT),
+    "rsa": ("process", max(1, CPU_COUNT // 2)),
+    "stream": ("thread", CPU_COUNT),
+}
+
+QUEUE_TIMEOUT = float(os.environ.get("SV_QUEUE_TIMEOUT", "5"))
+
+
+class WorkPool:
+    def __init__(self, kind):
+        default_type, default_workers = POOL_DEFAULTS[kind]
+        prefix = f"SV_{kind.upper()}"
+
+        self.kind = kind
+        self.type = os.environ.get(f"{prefix}_POOL", default_type)
+        if kind == "stream":
+            self.type = "thread"
+        self.workers = int(os.environ.get(f"{prefix}_WORKERS", default_workers))
+        self.queue = int(os.environ.get(f"{prefix}_QUEUE", self.workers * 4))
+        self.executor = None
+        self.slots = None
+        self.rejected = 0
+
+    def _start(self):
+        if self.type == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                               thread_name_prefix=f"sv-{self.kind}")
+        # Running plus queued jobs; anything beyond this waits for a slot and
+        # is turned away once QUEUE_TIMEOUT expires.
+        self.slots = asyncio.Semaphore(self.workers + self.queue)
+
+    async def run(self, func, *args, **kwargs):
+        if self.executor is None:
+            self._start()
+
+        try:
+            await asyncio.wait_for(self.slots.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(status_code=503,
+                                detail=f"Server busy ({self.kind} queue full), retry later",
+                                headers={"Retry-After": "1"})
+
+        try:
+            loop = asyncio.get_running_loop()
+            # Stage timings taken inside the task come back with its result
+            result, stages = await loop.run_in_executor(
+                self.executor, functools.partial(call_collecting, func, *args, **kwargs))
+        finally:
+            self.slots.release()
+        for name, seconds in stages:
+            record_stage(name, seconds)
+        return result
+
+    def stats(self):
+        in_use = 0
+        if self.slots is not None:
+            in_use = self.workers + self.queue - self.slots._value
+        return {
+            "type": self.type,
+            "workers": self.workers,
+            "queue": self.queue,
+            "in_flight": in_use,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+pools = {kind: WorkPool(kind) for kind in POOL_DEFAULTS}
+
+
+async def run_blocking(kind, func, *args, **kwargs):
+    return await pools[kind].run(func, *args, **kwargs)
+
+
+def pool_stats():
+    return {kind: pool.stats() for kind, pool in pools.items()}
+
+
+def shutdown_pools():
+    for pool in pools.values():
+        pool.shutdown()
@@ -0,0 +1,116 @@
+from collections import deque
+import asyncio
+import time
+import os
+
+from signature import generate_rsa_keys
+from executor import run_blocking
+
+
+# RSA key generation takes hundreds of milliseconds to seconds with a long
+# tail, so a bounded stock of key pairs is generated ahead of time in the rsa
+# process pool. Requests pop a ready pair and trigger a refill; only when the
+# stock is empty does a request wait on generation itself (a "fallback").
+
+KEY_POOL_SIZE = int(os.environ.get("SV_RSA_KEY_POOL_SIZE", 8))
+KEY_POOL_BITS = int(os.environ.get("SV_RSA_KEY_BITS", 2048))
+# Background generations in flight at once; kept low so refills don't crowd
+# out request-path work on the same pool
+KEY_POOL_REFILL = int(os.environ.get("SV_RSA_KEY_POOL_REFILL", 1))
+RATE_WINDOW = 60
+
+
+class RSAKeyPool:
+    def __init__(self, size=KEY_POOL_SIZE, bits=KEY_POOL_BITS, refill=KEY_POOL_REFILL):
+        self.size = size
+        self.bits = bits
+        self.refill_limit = max(1, refill)
+        self.ready = deque()
+        self.refilling = set()
+        self.generated = deque()     # completion times within RATE_WINDOW
+        self.generate_seconds = 0.0
+        self.total_generated = 0
+        self.served = 0
+        self.fallbacks = 0
+        self.errors = 0
+        self.closed = False
+
+    def start(self):
+        self.closed = False
+        self._refill()
+
+    async def close(self):
+        self.closed = True
+        for task in list(self.refilling):
+            task.cancel()
+        await asyncio.gather(*self.refilling, return_exceptions=True)
+        self.refilling.clear()
+
+    def _refill(self):
+        if self.closed or self.size <= 0:
+            return
+        while (len(self.ready) + len(self.refilling) < self.size
+               and len(self.refilling) < self.refill_limit):
+            task = asyncio.ensure_future(self._generate_one())
+            self.refilling.add(task)
+            task.add_done_callback(self._refilled)
+
+    async def _generate_one(self):
+        start = time.perf_counter()
+        pair = await run_blocking("rsa", generate_rsa_keys, self.bits)
+        self._record(time.perf_counter() - start)
+        self.ready.append(pair)
+
+    def _refilled(self, task):
+        self.refilling.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            # Pool saturated or worker died: back off and let the next
+            # request (or the next success) restart the refill
+            self.errors += 1
+            return
+        self._refill()
+
+    def _record(self, seconds):
+        now = time.monotonic()
+        self.generated.append(now)
+        while self.generated and self.generated[0] < now - RATE_WINDOW:
+            self.generated.popleft()
+        self.generate_seconds += seconds
+        self.total_generated += 1
+
+    async def get(self):
+        # Returns (private_pem, public_pem)
+        if self.ready:
+            pair = self.ready.popleft()
+            self.served += 1
+            self._refill()
+            return pair
+
+        self.fallbacks += 1
+        self._refill()
+        start = time.perf_counter()
+        pair = await run_blocking("rsa", generate_rsa_keys, self.bits)
+        self._record(time.perf_counter() - start)
+        return pair
+
+    def stats(self):
+        now = time.monotonic()
+        recent = sum(1 for t in self.generated if t >= now - RATE_WINDOW)
+        return {
+            "bits": self.bits,
+            "size": self.size,
+            "depth": len(self.ready),
+            "refilling": len(self.refilling),
+            "served_from_pool": self.served,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+            "generated": self.total_generated,
+            "refill_rate_per_min": recent * 60 / RATE_WINDOW,
+            "avg_generate_seconds": (self.generate_seconds / self.total_generated
+                                     if self.total_generated else None),
+        }
+
+
+rsa_key_pool = RSAKeyPool()
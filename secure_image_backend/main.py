@@ -1,22 +1,127 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+from typing import List
+from PIL import Image
+import functools
+import logging
+import asyncio
+import time
+import hashlib
+import base64
+import json
+import tempfile
+import zipfile
 import io
-
-from encryption import encrypt_image_aes, encrypt_image_shuffle
-from decryption import decrypt_image_aes, decrypt_image_shuffle
-from stego_hide import hide_message_in_image
-from stego_extract import extract_message
-from utils import generate_sha256
-from encryption_gcm import encrypt_aes_gcm, decrypt_aes_gcm
-from signature import generate_rsa_keys, sign_data, verify_signature
+import os
+
+from encryption import (derive_aes_key, CBCStreamEncryptor, encrypt_image_shuffle_file,
+                        encrypt_image_scramble, SHUFFLE_RNGS)
+from decryption import CBCStreamDecryptor, decrypt_image_shuffle_file, decrypt_image_scramble
+from stego_hide import (hide_message_in_image, hide_payload_in_image, stego_capacity,
+                        MIN_BITS_PER_CHANNEL, MAX_BITS_PER_CHANNEL)
+from stego_extract import extract_message, extract_payload
+from utils import generate_sha256, new_hashers, HASH_ALGORITHMS
+from encryption_gcm import (decrypt_aes_gcm, GCMStreamEncryptor, GCMStreamDecryptor,
+                            is_stream_container, key_cache, session_store, SessionLimitError,
+                            select_aead, seal_record, open_record, process_records, SegmentError,
+                            AEADS, DEFAULT_AEAD, DEFAULT_RECORD_SIZE, PARALLEL_SEGMENT_SIZE,
+                            PARALLEL_MIN_SEGMENT, TAG_SIZE)
+from signature import (sign_data, verify_signature, generate_keys, new_prehash, pem_algorithm,
+                       key_registry, SIGNATURE_ALGORITHMS)
 from watermark import add_watermark
 from attack_lab import tamper_data, compare_hash
-from metrics import execution_time
+from analysis import ByteAnalyzer, looks_like_image, pixel_histograms, DEFAULT_BLOCK_SIZE, MIN_BLOCK_SIZE
+from metrics import (MetricsMiddleware, render as render_metrics, watch_loop_lag, LOOP_LAG_INTERVAL,
+                     STREAM_ABORTS)
+from executor import run_blocking, pool_stats, shutdown_pools, pools
+from keypool import rsa_key_pool
+from result_cache import result_cache
+from pipeline import run_pipeline, validate_stages
+from merkle import build_manifest, inclusion_proof, levels_from_manifest, verify_inclusion
+from batch import (ALGORITHMS, OUTPUT_FORMATS, open_zip_entries, upload_entries, prepare_encrypt,
+                   prepare_decrypt, encrypted_name, decrypted_name, png_name, run_batch,
+                   digest_entries)
+
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Upper bound on one parallel AES-GCM read. Segment sizes come from the
+# client (or an untrusted container header) and go up to 64 MiB, so
+# "a segment per worker" alone is not a memory bound.
+PARALLEL_READ_BUDGET = int(os.environ.get("SV_GCM_PARALLEL_READ_BYTES", 8 * 1024 * 1024))
+
+logger = logging.getLogger("securevision")
+
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Time both AEADs once so "auto" never benchmarks on a request
+    await run_blocking("crypto", select_aead)
+    rsa_key_pool.start()
+    lag_task = asyncio.create_task(watch_loop_lag()) if LOOP_LAG_INTERVAL > 0 else None
+    yield
+    if lag_task:
+        lag_task.cancel()
+    await rsa_key_pool.close()
+    shutdown_pools()
 
 
 app = FastAPI(title="SecureVision Backend",
               description="Image Encryption & Steganography API",
-              version="1.0")
+              version="1.0",
+              lifespan=lifespan)
+
+# Request/byte counters, in-flight gauges and stage histograms for /metrics;
+# SV_SERVER_TIMING=1 also adds a Server-Timing header to every response.
+app.add_middleware(MetricsMiddleware, routes=app.router.routes)
+
+
+async def spool_to_disk(upload):
+    # Copy an upload to a named temp file so process-pool workers can open it
+    # by path instead of receiving the whole payload pickled. Returns the
+    # path and the upload's SHA-256, computed on the way through.
+    fd, path = tempfile.mkstemp(prefix="securevision-")
+    digest = hashlib.sha256()
+    with os.fdopen(fd, "wb") as fp:
+        while chunk := await upload.read(STREAM_CHUNK_SIZE):
+            digest.update(chunk)
+            fp.write(chunk)
+    return path, digest.hexdigest()
+
+
+def remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def shuffle_file_response(upload, endpoint, func, key, rng, filename):
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    src, digest = await spool_to_disk(upload)
+
+    cache_key = result_cache.key(endpoint, digest, key=key, rng=rng)
+    cached = await result_cache.aget(endpoint, cache_key)
+    if cached is not None:
+        remove_files(src)
+        return StreamingResponse(io.BytesIO(cached), media_type="image/png", headers=headers)
+
+    fd, dst = tempfile.mkstemp(prefix="securevision-", suffix=".png")
+    os.close(fd)
+    try:
+        await run_blocking("image", func, src, dst, key, rng)
+        if os.path.getsize(dst) <= result_cache.max_entry:
+            with open(dst, "rb") as fp:
+                await result_cache.aput(cache_key, fp.read())
+    except BaseException:
+        remove_files(src, dst)
+        raise
+
+    return FileResponse(dst, media_type="image/png", headers=headers,
+                        background=BackgroundTask(remove_files, src, dst))
 
 
 @app.get("/")
@@ -24,25 +129,53 @@ def home():
     return {"message": "SecureVision Backend Running"}
 
 
+@app.get("/cache/stats")
+def cache_stats():
+    return result_cache.stats()
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/executor/stats")
+def executor_stats():
+    return pool_stats()
+
+
 # ========================= IMAGE ENCRYPTION =========================
 
 @app.post("/encrypt/aes")
 async def encrypt_aes(image: UploadFile = File(...), password: str = Form(...)):
-    img_bytes = await image.read()
-    encrypted_data = encrypt_image_aes(img_bytes, password)
+    key = await run_blocking("crypto", derive_aes_key, password)
+    encryptor = CBCStreamEncryptor(key)
+
+    async def blocks():
+        yield encryptor.header
+        while chunk := await image.read(STREAM_CHUNK_SIZE):
+            yield await run_blocking("stream", encryptor.update, chunk)
+        yield encryptor.finalize()
 
-    return StreamingResponse(io.BytesIO(encrypted_data),
+    return StreamingResponse(blocks(),
                              media_type="application/octet-stream",
                              headers={"Content-Disposition": "attachment; filename=encrypted.bin"})
 
 
 @app.post("/decrypt/aes")
 async def decrypt_aes(file: UploadFile = File(...), password: str = Form(...)):
-    enc_bytes = await file.read()
-
-    decrypted_img = decrypt_image_aes(enc_bytes, password)
-
-    return StreamingResponse(io.BytesIO(decrypted_img),
+    key = await run_blocking("crypto", derive_aes_key, password)
+    decryptor = CBCStreamDecryptor(key)
+
+    # CBC has no authentication, so the only detectable errors, a ciphertext
+    # that isn't whole blocks or (in marked files) bad padding, usually from
+    # a wrong password, show up at the end and abort the stream.
+    async def blocks():
+        while chunk := await file.read(STREAM_CHUNK_SIZE):
+            yield await run_blocking("stream", decryptor.update, chunk)
+        yield decryptor.finalize()
+
+    return StreamingResponse(blocks(),
                              media_type="image/png",
                              headers={"Content-Disposition": "attachment; filename=decrypted.png"})
 
@@ -50,25 +183,49 @@ async def decrypt_aes(file: UploadFile = File(...), password: str = Form(...)):
 # ========================= SHUFFLE ENCRYPTION ======================
 
 @app.post("/encrypt/shuffle")
-async def encrypt_shuffle(image: UploadFile = File(...), key: int = Form(...)):
+async def encrypt_shuffle(image: UploadFile = File(...), key: int = Form(...),
+                          rng: str = Form("legacy")):
+    if rng not in SHUFFLE_RNGS:
+        return JSONResponse({"error": f"rng must be one of {', '.join(SHUFFLE_RNGS)}"}, status_code=400)
+    return await shuffle_file_response(image, "encrypt/shuffle", encrypt_image_shuffle_file, key, rng,
+                                       "shuffled.png")
+
+
+@app.post("/decrypt/shuffle")
+async def decrypt_shuffle(image: UploadFile = File(...), key: int = Form(...),
+                          rng: str = Form("legacy")):
+    if rng not in SHUFFLE_RNGS:
+        return JSONResponse({"error": f"rng must be one of {', '.join(SHUFFLE_RNGS)}"}, status_code=400)
+    return await shuffle_file_response(image, "decrypt/shuffle", decrypt_image_shuffle_file, key, rng,
+                                       "unshuffled.png")
+
+
+@app.post("/encrypt/scramble")
+async def encrypt_scramble(image: UploadFile = File(...), key: int = Form(...),
+                           block_size: int = Form(16), inner: bool = Form(True)):
+    if not 2 <= block_size <= 256:
+        return JSONResponse({"error": "block_size must be between 2 and 256"}, status_code=400)
     img_bytes = await image.read()
 
-    encrypted_img = encrypt_image_shuffle(img_bytes, key)
+    encrypted_img = await run_blocking("image", encrypt_image_scramble, img_bytes, key, block_size, inner)
 
     return StreamingResponse(io.BytesIO(encrypted_img),
                              media_type="image/png",
-                             headers={"Content-Disposition": "attachment; filename=shuffled.png"})
+                             headers={"Content-Disposition": "attachment; filename=scrambled.png"})
 
 
-@app.post("/decrypt/shuffle")
-async def decrypt_shuffle(image: UploadFile = File(...), key: int = Form(...)):
+@app.post("/decrypt/scramble")
+async def decrypt_scramble(image: UploadFile = File(...), key: int = Form(...),
+                           block_size: int = Form(16), inner: bool = Form(True)):
+    if not 2 <= block_size <= 256:
+        return JSONResponse({"error": "block_size must be between 2 and 256"}, status_code=400)
     img_bytes = await image.read()
 
-    decrypted_img = decrypt_image_shuffle(img_bytes, key)
+    decrypted_img = await run_blocking("image", decrypt_image_scramble, img_bytes, key, block_size, inner)
 
     return StreamingResponse(io.BytesIO(decrypted_img),
                              media_type="image/png",
-                             headers={"Content-Disposition": "attachment; filename=unshuffled.png"})
+                             headers={"Content-Disposition": "attachment; filename=unscrambled.png"})
 
 
 # ========================= STEGANOGRAPHY ============================
@@ -77,7 +234,7 @@ async def decrypt_shuffle(image: UploadFile = File(...), key: int = Form(...)):
 async def hide(image: UploadFile = File(...), message: str = Form(...)):
     img_bytes = await image.read()
 
-    stego_image = hide_message_in_image(img_bytes, message)
+    stego_image = await run_blocking("image", hide_message_in_image, img_bytes, message)
 
     return StreamingResponse(io.BytesIO(stego_image),
                              media_type="image/png",
@@ -88,51 +245,433 @@ async def hide(image: UploadFile = File(...), message: str = Form(...)):
 async def extract(image: UploadFile = File(...)):
     img_bytes = await image.read()
 
-    msg = extract_message(img_bytes)
+    digest = await run_blocking("crypto", generate_sha256, img_bytes)
+    cache_key = result_cache.key("stego/extract", digest)
+    cached = await result_cache.aget("stego/extract", cache_key)
+    if cached is not None:
+        return JSONResponse({"hidden_message": cached.decode()})
+
+    msg = await run_blocking("image", extract_message, img_bytes)
+    await result_cache.aput(cache_key, msg.encode())
     return JSONResponse({"hidden_message": msg})
 
 
+@app.post("/stego/v2/hide")
+async def hide_v2(image: UploadFile = File(...),
+                  message: str = Form(None),
+                  payload: UploadFile = File(None),
+                  bits_per_channel: int = Form(1),
+                  compress: bool = Form(False)):
+    if (message is None) == (payload is None):
+        return JSONResponse({"error": "Provide exactly one of message or payload"}, status_code=400)
+
+    img_bytes = await image.read()
+    data = message.encode() if message is not None else await payload.read()
+
+    try:
+        stego_image = await run_blocking("image", hide_payload_in_image, img_bytes, data,
+                                         bits_per_channel, compress, is_text=message is not None)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except OSError:
+        return JSONResponse({"error": "Upload is not a readable image"}, status_code=400)
+
+    return StreamingResponse(io.BytesIO(stego_image),
+                             media_type="image/png",
+                             headers={"Content-Disposition": "attachment; filename=stego.png"})
+
+
+@app.post("/stego/v2/extract")
+async def extract_v2(image: UploadFile = File(...)):
+    img_bytes = await image.read()
+
+    try:
+        data, is_text = await run_blocking("image", extract_payload, img_bytes)
+    except ValueError:
+        return JSONResponse({"error": "No valid stego payload found"}, status_code=400)
+    except OSError:
+        return JSONResponse({"error": "Upload is not a readable image"}, status_code=400)
+
+    if is_text:
+        return JSONResponse({"hidden_message": data.decode(errors="replace")})
+    return StreamingResponse(io.BytesIO(data),
+                             media_type="application/octet-stream",
+                             headers={"Content-Disposition": "attachment; filename=payload.bin"})
+
+
+@app.post("/stego/capacity")
+async def capacity(image: UploadFile = File(...)):
+    img_bytes = await image.read()
+
+    # Only the header is parsed; no pixel data is decoded
+    try:
+        width, height = Image.open(io.BytesIO(img_bytes)).size
+    except OSError:
+        return JSONResponse({"error": "Upload is not a readable image"}, status_code=400)
+    return {
+        "width": width,
+        "height": height,
+        "capacity_bytes": {bits: stego_capacity(width, height, bits)
+                           for bits in range(MIN_BITS_PER_CHANNEL, MAX_BITS_PER_CHANNEL + 1)}
+    }
+
+
 # ========================= HASH CHECK ===============================
 
 @app.post("/hash")
-async def hash_file(file: UploadFile = File(...)):
-    data = await file.read()
-    return {"sha256_hash": generate_sha256(data)}
+async def hash_file(file: UploadFile = File(...), algorithms: str = Form(",".join(HASH_ALGORITHMS))):
+    try:
+        hashers = new_hashers([name.strip() for name in algorithms.split(",") if name.strip()])
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    hashers.setdefault("sha256", hashlib.sha256())
+
+    # hashlib releases the GIL on large buffers, so every digest runs in its
+    # own thread while the next chunk is being read. The hashers are stateful
+    # and unpicklable, hence the thread-only stream pool.
+    start = time.perf_counter()
+    total = 0
+    pending = None
+    while chunk := await file.read(STREAM_CHUNK_SIZE):
+        if pending is not None:
+            await pending
+        total += len(chunk)
+        pending = asyncio.gather(*(run_blocking("stream", h.update, chunk) for h in hashers.values()))
+    if pending is not None:
+        await pending
+    elapsed = time.perf_counter() - start
+
+    return {
+        "sha256_hash": hashers["sha256"].hexdigest(),
+        "digests": {name: h.hexdigest() for name, h in hashers.items()},
+        "bytes": total,
+        "seconds": round(elapsed, 4),
+        "throughput_mb_s": round(total / 1e6 / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+# ========================= ANALYSIS ===============================
+
+@app.post("/analyze")
+async def analyze(file: UploadFile = File(...), block_size: int = Form(DEFAULT_BLOCK_SIZE)):
+    if block_size < MIN_BLOCK_SIZE:
+        return JSONResponse({"error": f"block_size must be at least {MIN_BLOCK_SIZE}"}, status_code=400)
+
+    # One pass: each chunk is analyzed in a stream-pool thread (the analyzer
+    # is stateful) while the next is read. Images are also spooled to disk
+    # for the pixel histograms, which need the decoded raster.
+    analyzer = ByteAnalyzer(block_size)
+    start = time.perf_counter()
+    spool = path = None
+    pending = None
+    try:
+        while chunk := await file.read(STREAM_CHUNK_SIZE):
+            if analyzer.total == 0 and pending is None and looks_like_image(chunk):
+                fd, path = tempfile.mkstemp(prefix="securevision-")
+                spool = os.fdopen(fd, "wb")
+            if spool is not None:
+                spool.write(chunk)
+            if pending is not None:
+                await pending
+            pending = asyncio.ensure_future(run_blocking("stream", analyzer.update, chunk))
+        if pending is not None:
+            await pending
+        if analyzer.total == 0:
+            return JSONResponse({"error": "Empty file"}, status_code=400)
+
+        result = analyzer.result()
+        result["image"] = None
+        if spool is not None:
+            spool.close()
+            try:
+                result["image"] = await run_blocking("image", pixel_histograms, path)
+            except HTTPException:
+                raise
+            except Exception as e:
+                # Truncated, unsupported or over the pixel limit: bytes only
+                result["image_error"] = str(e)
+    finally:
+        if spool is not None:
+            spool.close()
+            remove_files(path)
+
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def parallel_read_size(segment_bytes):
+    return min(segment_bytes * pools["crypto"].workers, PARALLEL_READ_BUDGET)
+
+
+async def run_records(func, context, jobs, parallel):
+    # Seal/open one read's worth of container records. In parallel mode every
+    # segment is its own crypto-pool task and gather keeps them in order.
+    if not jobs:
+        return b""
+    if not parallel:
+        return await run_blocking("stream", process_records, func, context, jobs)
+    parts = await asyncio.gather(*(run_blocking("crypto", process_records, func, context, [job])
+                                   for job in jobs))
+    return b"".join(parts)
+
 
 @app.post("/encrypt/aes-gcm")
-async def aes_gcm_encrypt(file: UploadFile = File(...), password: str = Form(...)):
-    data = await file.read()
-    encrypted = encrypt_aes_gcm(data, password)
-    return StreamingResponse(io.BytesIO(encrypted),
+async def aes_gcm_encrypt(file: UploadFile = File(...), password: str = Form(...),
+                          session: str = Form(None), algorithm: str = Form(DEFAULT_AEAD),
+                          parallel: bool = Form(False), segment_size: int = Form(None)):
+    # algorithm: aes-gcm, chacha20-poly1305 or auto; recorded in the header.
+    # session: a token from POST /aes-gcm/session, to reuse one salt (and
+    # PBKDF2 run) per password across its uploads. parallel seals segments
+    # (default 1 MiB, also in the header) across the crypto pool instead of
+    # on one core.
+    record_size = segment_size
+    if record_size is None:
+        record_size = PARALLEL_SEGMENT_SIZE if parallel else DEFAULT_RECORD_SIZE
+    try:
+        salt = session_store.salt(password, session) if session else None
+        encryptor = await run_blocking("crypto", GCMStreamEncryptor, password, record_size=record_size,
+                                       algorithm=algorithm, salt=salt)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    read_size = parallel_read_size(record_size) if parallel else STREAM_CHUNK_SIZE
+
+    async def records():
+        yield encryptor.header
+        while chunk := await file.read(read_size):
+            jobs = await run_blocking("stream", encryptor.split, chunk)
+            yield await run_records(seal_record, encryptor.context, jobs, parallel)
+        yield await run_records(seal_record, encryptor.context, encryptor.split_final(), parallel)
+
+    return StreamingResponse(records(),
         media_type="application/octet-stream",
-        headers={"Content-Disposition": "attachment; filename=aesgcm.bin"})
+        headers={"Content-Disposition": "attachment; filename=aesgcm.bin",
+                 "X-Cipher": encryptor.algorithm})
     
 
 @app.post("/decrypt/aes-gcm")
 async def aes_gcm_decrypt(file: UploadFile = File(...), password: str = Form(...)):
-    data = await file.read()
+    first = await file.read(STREAM_CHUNK_SIZE)
+
+    if not is_stream_container(first):
+        # Single-shot container produced before streaming support
+        data = first + await file.read()
+        try:
+            decrypted = await run_blocking("crypto", decrypt_aes_gcm, data, password)
+            return StreamingResponse(io.BytesIO(decrypted),
+                media_type="image/png",
+                headers={"Content-Disposition": "attachment; filename=recovered.png"})
+        except ValueError:
+            return JSONResponse({"error": "Integrity Failed / Wrong Password"}, status_code=400)
+
+    # Containers written with large segments are opened in parallel, the
+    # same way they were sealed.
+    decryptor = GCMStreamDecryptor(password)
+    parallel = False
+    read_size = STREAM_CHUNK_SIZE
+
+    async def decrypt(chunk):
+        nonlocal parallel, read_size
+        jobs = await run_blocking("stream", decryptor.split, chunk)
+        if decryptor.header is not None and decryptor.record_size >= PARALLEL_MIN_SEGMENT:
+            parallel = True
+            read_size = parallel_read_size(decryptor.record_size + TAG_SIZE)
+        return await run_records(open_record, decryptor.context, jobs, parallel)
+
+    async def decrypt_final():
+        jobs = await run_blocking("stream", decryptor.split_final)
+        return await run_records(open_record, decryptor.context, jobs, parallel)
+
+    # Authenticate the first record before committing to a 200 response, so a
+    # wrong password still gets a clean error instead of a cut-off stream.
+    # A later failure can no longer change the status, so it is logged,
+    # counted and re-raised to abort the connection: a client must never
+    # mistake a tampered or truncated stream for a complete one.
+    try:
+        head = await decrypt(first)
+        chunk = first
+        while not head and chunk:
+            chunk = await file.read(read_size)
+            head = await decrypt(chunk)
+        if not chunk:
+            head += await decrypt_final()
+    except SegmentError as e:
+        return JSONResponse({"error": "Integrity Failed / Wrong Password", "segment": e.segment},
+                            status_code=400)
+    except ValueError as e:
+        return JSONResponse({"error": f"Integrity Failed / Wrong Password: {e}"}, status_code=400)
+
+    async def records():
+        yield head
+        try:
+            while chunk := await file.read(read_size):
+                yield await decrypt(chunk)
+            yield await decrypt_final()
+        except ValueError as e:
+            segment = getattr(e, "segment", None)
+            STREAM_ABORTS.inc(endpoint="/decrypt/aes-gcm")
+            logger.warning("AES-GCM decrypt stream aborted at segment %s: %s", segment, e)
+            raise
+
+    return StreamingResponse(records(),
+        media_type="image/png",
+        headers={"Content-Disposition": "attachment; filename=recovered.png"})
+
+
+@app.post("/aes-gcm/session")
+def aes_gcm_session():
+    # ttl_seconds is an idle timeout: every upload in the session renews it
     try:
-        decrypted = decrypt_aes_gcm(data, password)
-        return StreamingResponse(io.BytesIO(decrypted),
-            media_type="image/png",
-            headers={"Content-Disposition": "attachment; filename=recovered.png"})
-    except:
-        return JSONResponse({"error": "Integrity Failed / Wrong Password"}, status_code=400)
+        token = session_store.open()
+    except SessionLimitError as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    return {"session": token, "ttl_seconds": session_store.ttl}
+
+
+@app.get("/aes-gcm/key-cache")
+def aes_gcm_key_cache():
+    return {**key_cache.stats(), "sessions": session_store.stats()}
+
+
+@app.get("/aes-gcm/ciphers")
+def aes_gcm_ciphers():
+    return {"algorithms": list(AEADS), "default": DEFAULT_AEAD, "auto": select_aead()}
+
+
+# ========================= BATCH ====================================
+
+def _batch_entries(files, archive, output_format):
+    # (entries, None) or (None, error response)
+    if output_format not in OUTPUT_FORMATS:
+        return None, JSONResponse({"error": f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}, status_code=400)
+    if not files and archive is None:
+        return None, JSONResponse({"error": "Provide files or a ZIP archive"}, status_code=400)
+
+    entries = upload_entries(files or [])
+    if archive is not None:
+        try:
+            entries += open_zip_entries(archive.file)
+        except zipfile.BadZipFile:
+            return None, JSONResponse({"error": "archive is not a valid ZIP file"}, status_code=400)
+        except ValueError as e:
+            return None, JSONResponse({"error": str(e)}, status_code=400)
+    return entries, None
+
+
+def _batch_response(stream, output_format):
+    return StreamingResponse(stream,
+        media_type=OUTPUT_FORMATS[output_format],
+        headers={"Content-Disposition": f"attachment; filename=batch.{output_format}"})
+
+
+async def _batch(files, archive, password, algorithm, output_format, prepare, rename):
+    if algorithm not in ALGORITHMS:
+        return JSONResponse({"error": f"algorithm must be one of {', '.join(ALGORITHMS)}"}, status_code=400)
+    entries, error = _batch_entries(files, archive, output_format)
+    if error:
+        return error
+
+    transform = await prepare(password, algorithm)
+    return _batch_response(run_batch(entries, transform, rename, output_format), output_format)
+
+
+@app.post("/batch/encrypt")
+async def batch_encrypt(files: List[UploadFile] = File(None),
+                        archive: UploadFile = File(None),
+                        password: str = Form(...),
+                        algorithm: str = Form("aes-gcm"),
+                        output_format: str = Form("zip")):
+    return await _batch(files, archive, password, algorithm, output_format,
+                        prepare_encrypt, encrypted_name)
+
+
+@app.post("/batch/decrypt")
+async def batch_decrypt(files: List[UploadFile] = File(None),
+                        archive: UploadFile = File(None),
+                        password: str = Form(...),
+                        algorithm: str = Form("aes-gcm"),
+                        output_format: str = Form("zip")):
+    return await _batch(files, archive, password, algorithm, output_format,
+                        prepare_decrypt, decrypted_name)
 
 
 @app.get("/signature/generate-keys")
-async def gen_keys():
-    private, public = generate_rsa_keys()
+async def gen_keys(algorithm: str = "rsa"):
+    if algorithm not in SIGNATURE_ALGORITHMS:
+        return JSONResponse({"error": f"Unsupported algorithm. Choose from {', '.join(SIGNATURE_ALGORITHMS)}"},
+                            status_code=400)
+    private, public = await new_key_pair(algorithm)
     return {
+        "algorithm": algorithm,
         "private_key": private.decode(),
         "public_key": public.decode()
     }
 
 
+async def new_key_pair(algorithm):
+    if algorithm == "rsa":
+        return await rsa_key_pool.get()
+    # EC keys generate in microseconds; no need for a pool
+    return await run_blocking("crypto", generate_keys, algorithm)
+
+
+async def prehash_upload(upload, prehash, pem, key_id):
+    # Stream the upload through the pre-hash so it is never fully buffered.
+    # The key's algorithm is needed up front since Ed25519ph only takes SHA-512.
+    if key_id:
+        algorithm = await run_blocking("stream", key_registry.algorithm, key_id)
+    else:
+        algorithm = await run_blocking("crypto", pem_algorithm, pem.encode())
+    h = new_prehash(prehash, algorithm)
+    while chunk := await upload.read(STREAM_CHUNK_SIZE):
+        await run_blocking("stream", h.update, chunk)
+    return h
+
+
+async def sign_with(data, private_key, key_id):
+    # data is bytes, or a hash object from prehash_upload (which stays on the
+    # thread-only stream pool). Raises KeyError for an unknown key_id,
+    # ValueError for unusable keys.
+    if key_id:
+        return await run_blocking("stream", key_registry.sign, key_id, data)
+    pool = "crypto" if isinstance(data, bytes) else "stream"
+    return await run_blocking(pool, sign_data, data, private_key.encode())
+
+
+async def verify_with(data, sig, public_key, key_id):
+    if key_id:
+        return await run_blocking("stream", key_registry.verify, key_id, data, sig)
+    pool = "crypto" if isinstance(data, bytes) else "stream"
+    return await run_blocking(pool, verify_signature, data, sig, public_key.encode())
+
+
+def key_reference(public_key, key_id):
+    # Cache-key component for the verifying key. A key ID names exactly one
+    # stored key, so it identifies the key as well as the PEM hash does.
+    return f"id:{key_id}" if key_id else generate_sha256(public_key.encode())
+
+
+@app.get("/signature/key-pool")
+async def key_pool_stats():
+    return rsa_key_pool.stats()
+
+
 @app.post("/signature/sign")
-async def sign_image(file: UploadFile = File(...), private_key: str = Form(...)):
-    data = await file.read()
-    sig = sign_data(data, private_key.encode())
+async def sign_image(file: UploadFile = File(...),
+                     private_key: str = Form(None),
+                     key_id: str = Form(None),
+                     prehash: str = Form(None)):
+    if not private_key and not key_id:
+        return JSONResponse({"error": "Provide private_key or key_id"}, status_code=400)
+    try:
+        if prehash:
+            data = await prehash_upload(file, prehash, private_key, key_id)
+        else:
+            data = await file.read()
+        sig = await sign_with(data, private_key, key_id)
+    except KeyError:
+        return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
     return StreamingResponse(io.BytesIO(sig),
         media_type="application/octet-stream",
         headers={"Content-Disposition": "attachment; filename=signature.sig"})
@@ -141,30 +680,254 @@ async def sign_image(file: UploadFile = File(...), private_key: str = Form(...))
 async def verify_image_signature(
     file: UploadFile = File(...),
     signature_file: UploadFile = File(...),
-    public_key: str = Form(...)
+    public_key: str = Form(None),
+    key_id: str = Form(None),
+    prehash: str = Form(None)
 ):
-    data = await file.read()
+    if not public_key and not key_id:
+        return JSONResponse({"error": "Provide public_key or key_id"}, status_code=400)
     sign = await signature_file.read()
 
-    status = verify_signature(data, sign, public_key.encode())
+    try:
+        if prehash:
+            data = await prehash_upload(file, prehash, public_key, key_id)
+            digest = f"{prehash}:{data.hexdigest()}"
+        else:
+            data = await file.read()
+            digest = await run_blocking("crypto", generate_sha256, data)
+    except KeyError:
+        return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    cache_key = result_cache.key("signature/verify", digest,
+                                 signature=generate_sha256(sign),
+                                 public_key=key_reference(public_key, key_id))
+    cached = await result_cache.aget("signature/verify", cache_key)
+    if cached is not None:
+        return {"verified": cached == b"1"}
+
+    try:
+        status = await verify_with(data, sign, public_key, key_id)
+    except KeyError:
+        return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+    await result_cache.aput(cache_key, b"1" if status else b"0")
     return {"verified": status}
 
 
+# Register a key once, then sign/verify by key_id without resending or
+# re-parsing the PEM on every request. The key_id of a private key is a
+# secret handle returned only here: treat it like the key itself.
+@app.post("/keys/register")
+async def register_key(key: str = Form(...)):
+    try:
+        key_id, delete_token, has_private, algorithm = await run_blocking(
+            "stream", key_registry.register, key.encode())
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid key: {e}"}, status_code=400)
+    result = {"key_id": key_id, "has_private": has_private, "algorithm": algorithm}
+    if delete_token:
+        result["delete_token"] = delete_token
+    return result
+
+
+@app.post("/keys/generate")
+async def generate_registered_key(algorithm: str = Form("rsa"),
+                                  export_private: bool = Form(False)):
+    if algorithm not in SIGNATURE_ALGORITHMS:
+        return JSONResponse({"error": f"Unsupported algorithm. Choose from {', '.join(SIGNATURE_ALGORITHMS)}"},
+                            status_code=400)
+    private, public = await new_key_pair(algorithm)
+    try:
+        key_id, _, _, _ = await run_blocking("stream", key_registry.register, private)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    result = {"key_id": key_id, "algorithm": algorithm, "public_key": public.decode()}
+    if export_private:
+        result["private_key"] = private.decode()
+    return result
+
+
+@app.get("/keys/stats")
+async def key_registry_stats():
+    return key_registry.stats()
+
+
+@app.get("/keys/{key_id}")
+async def get_public_key(key_id: str):
+    try:
+        public = await run_blocking("stream", key_registry.public_key, key_id)
+    except KeyError:
+        return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+    return {"key_id": key_id, "public_key": public.decode()}
+
+
+@app.delete("/keys/{key_id}")
+async def delete_key(key_id: str, delete_token: str = None):
+    try:
+        removed = key_registry.remove(key_id, delete_token)
+    except PermissionError:
+        return JSONResponse({"error": "Invalid delete_token"}, status_code=403)
+    if not removed:
+        return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+    return {"key_id": key_id, "deleted": True}
+
+
 @app.post("/watermark")
 async def watermark(image: UploadFile = File(...), text: str = Form(...)):
     img = await image.read()
-    output = add_watermark(img, text)
+
+    digest = await run_blocking("crypto", generate_sha256, img)
+    cache_key = result_cache.key("watermark", digest, text=text)
+    output = await result_cache.aget("watermark", cache_key)
+    if output is None:
+        output = await run_blocking("image", add_watermark, img, text)
+        await result_cache.aput(cache_key, output)
 
     return StreamingResponse(io.BytesIO(output),
         media_type="image/png",
         headers={"Content-Disposition": "attachment; filename=watermarked.png"})
 
+@app.post("/watermark/batch")
+async def watermark_batch(files: List[UploadFile] = File(None),
+                          archive: UploadFile = File(None),
+                          text: str = Form(...),
+                          output_format: str = Form("zip")):
+    entries, error = _batch_entries(files, archive, output_format)
+    if error:
+        return error
+
+    # Each image worker renders the text layer once and reuses it for every
+    # image of the same size
+    stamp_entry = functools.partial(add_watermark, text=text)
+    return _batch_response(run_batch(entries, stamp_entry, png_name, output_format, pool="image"),
+                           output_format)
+
+# ========================= MANIFESTS ================================
+
+@app.post("/manifest/create")
+async def manifest_create(files: List[UploadFile] = File(None),
+                          archive: UploadFile = File(None),
+                          private_key: str = Form(None),
+                          key_id: str = Form(None),
+                          include_proofs: bool = Form(False)):
+    if not private_key and not key_id:
+        return JSONResponse({"error": "Provide private_key or key_id"}, status_code=400)
+    entries, error = _batch_entries(files, archive, "zip")
+    if error:
+        return error
+
+    try:
+        digests = await digest_entries(entries)
+        manifest, levels = build_manifest(digests)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # One signature for the whole set
+    try:
+        sig = await sign_with(bytes.fromhex(manifest["root"]), private_key, key_id)
+    except KeyError:
+        return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    result = {"manifest": manifest, "signature": base64.b64encode(sig).decode()}
+    if include_proofs:
+        result["proofs"] = {name: inclusion_proof(levels, i) for i, (name, _) in enumerate(digests)}
+    return result
+
+
+@app.post("/manifest/proof")
+async def manifest_proof(manifest: UploadFile = File(...), name: str = Form(...)):
+    try:
+        data = json.loads(await manifest.read())
+        names = [e["name"] for e in data["entries"]]
+        levels = await run_blocking("crypto", levels_from_manifest, data)
+    except (ValueError, KeyError, TypeError) as e:
+        return JSONResponse({"error": f"Invalid manifest: {e}"}, status_code=400)
+
+    if name not in names:
+        return JSONResponse({"error": f"{name} is not in the manifest"}, status_code=404)
+    return {"name": name, "root": data["root"], "proof": inclusion_proof(levels, names.index(name))}
+
+
+@app.post("/manifest/verify")
+async def manifest_verify(file: UploadFile = File(...),
+                          name: str = Form(...),
+                          proof: str = Form(...),
+                          root: str = Form(...),
+                          signature: str = Form(...),
+                          public_key: str = Form(None),
+                          key_id: str = Form(None)):
+    if not public_key and not key_id:
+        return JSONResponse({"error": "Provide public_key or key_id"}, status_code=400)
+    try:
+        steps = json.loads(proof)
+        root_bytes = bytes.fromhex(root)
+        sig = base64.b64decode(signature)
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid proof, root or signature: {e}"}, status_code=400)
+
+    # The root signature is checked once per (root, signature, key) and then
+    # served from the result cache, so each further member costs one file
+    # hash plus log2(N) node hashes.
+    cache_key = result_cache.key("manifest/root", root, signature=generate_sha256(sig),
+                                 public_key=key_reference(public_key, key_id))
+    cached = await result_cache.aget("manifest/root", cache_key)
+    if cached is not None:
+        root_valid = cached == b"1"
+    else:
+        try:
+            root_valid = await verify_with(root_bytes, sig, public_key, key_id)
+        except KeyError:
+            return JSONResponse({"error": f"Unknown key_id {key_id}"}, status_code=404)
+        await result_cache.aput(cache_key, b"1" if root_valid else b"0")
+
+    data = await file.read()
+    digest = bytes.fromhex(await run_blocking("crypto", generate_sha256, data))
+    try:
+        included = verify_inclusion(name, digest, steps, root_bytes)
+    except (ValueError, TypeError):
+        return JSONResponse({"error": "Malformed proof"}, status_code=400)
+
+    return {"verified": root_valid and included, "root_signature_valid": root_valid, "included": included}
+
+
+# ========================= PIPELINE =================================
+
+@app.post("/pipeline")
+async def pipeline(file: UploadFile = File(...), stages: str = Form(...)):
+    try:
+        stage_list = json.loads(stages)
+        validate_stages(stage_list)
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid stages: {e}"}, status_code=400)
+
+    data = await file.read()
+    try:
+        artifact, media_type, signature, timings = await run_blocking("image", run_pipeline, data, stage_list)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except OSError:
+        # UnidentifiedImageError included: image stages need a decodable upload
+        return JSONResponse({"error": "Upload is not a readable image"}, status_code=400)
+
+    filename = "pipeline.png" if media_type == "image/png" else "pipeline.bin"
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Server-Timing": ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings),
+    }
+    if signature is not None:
+        headers["X-Signature"] = base64.b64encode(signature).decode()
+
+    return StreamingResponse(io.BytesIO(artifact), media_type=media_type, headers=headers)
+
+
 @app.post("/attack/tamper")
 async def tamper(file: UploadFile = File(...)):
     data = await file.read()
-    tampered = tamper_data(data)
+    tampered = await run_blocking("crypto", tamper_data, data)
 
-    o, m = compare_hash(data, tampered)
+    o, m = await run_blocking("crypto", compare_hash, data, tampered)
 
     return {
         "original_hash": o,
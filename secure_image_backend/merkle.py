@@ -0,0 +1,96 @@
+import hashlib
+import struct
+
+
+# Merkle tree over a set of files, so a whole dataset is signed once and any
+# single file can be checked against the signed root with one file hash plus
+# log2(N) node hashes.
+#
+#   leaf = SHA256(0x00 | len(name) | name | SHA256(file))
+#   node = SHA256(0x01 | left | right)
+#
+# Leaves and nodes are domain-separated, and the file name is bound into its
+# leaf so entries can't be swapped. An unpaired node at the end of a level is
+# promoted unchanged to the next level.
+
+MANIFEST_VERSION = 1
+
+
+def leaf_hash(name, file_digest):
+    encoded = name.encode()
+    return hashlib.sha256(b"\x00" + struct.pack(">I", len(encoded)) + encoded + file_digest).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def build_levels(leaves):
+    if not leaves:
+        raise ValueError("Cannot build a Merkle tree with no entries")
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def inclusion_proof(levels, index):
+    # List of (side, sibling hash) from leaf to root; side says where the
+    # sibling sits relative to the running hash.
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(("left" if sibling < index else "right", level[sibling].hex()))
+        index //= 2
+    return proof
+
+
+def root_from_proof(leaf, proof):
+    current = leaf
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        if side == "left":
+            current = node_hash(sibling, current)
+        elif side == "right":
+            current = node_hash(current, sibling)
+        else:
+            raise ValueError(f"Invalid proof step side '{side}'")
+    return current
+
+
+def verify_inclusion(name, file_digest, proof, root):
+    return root_from_proof(leaf_hash(name, file_digest), proof) == root
+
+
+def build_manifest(entries):
+    """entries: list of (name, sha256 digest bytes) in manifest order.
+
+    Returns (manifest dict, levels). The root in the manifest is what gets
+    signed.
+    """
+    names = [name for name, _ in entries]
+    if len(set(names)) != len(names):
+        raise ValueError("Manifest entry names must be unique")
+
+    levels = build_levels([leaf_hash(name, digest) for name, digest in entries])
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "hash": "sha256",
+        "count": len(entries),
+        "root": levels[-1][0].hex(),
+        "entries": [{"name": name, "sha256": digest.hex()} for name, digest in entries],
+    }
+    return manifest, levels
+
+
+def levels_from_manifest(manifest):
+    entries = [(e["name"], bytes.fromhex(e["sha256"])) for e in manifest["entries"]]
+    rebuilt, levels = build_manifest(entries)
+    if rebuilt["root"] != manifest["root"]:
+        raise ValueError("Manifest entries do not match its root")
+    return levels
@@ -1,9 +1,273 @@
+from starlette.routing import Match
+from contextlib import contextmanager
+from collections import defaultdict
+import contextvars
+import asyncio
+import threading
 import time
+import os
+
+
+# Instrumentation layer exported on /metrics in the Prometheus text format.
+#
+# Work code wraps its stages in `with stage("kdf"):` etc. Inside a pool task
+# the timings are collected thread-locally and shipped back with the result
+# (see call_collecting), so stages measured in process-pool workers still
+# reach this process. On the event loop they are attributed to the current
+# request, which MetricsMiddleware tracks in a context variable.
+#
+# Stage names in use: upload_read, decode, kdf, cipher, stego, watermark,
+# shuffle, scramble, png_encode, sign, verify, analyze, response_write.
+#
+# A background task also samples event-loop lag (how late a timer fires),
+# attributed to every endpoint in flight at the time: lag that only shows
+# up under one endpoint is that endpoint blocking the loop.
+
+SERVER_TIMING = os.environ.get("SV_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+# Seconds between event-loop lag samples; 0 disables the sampler
+LOOP_LAG_INTERVAL = float(os.environ.get("SV_LOOP_LAG_INTERVAL", "0.05"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
 
 def execution_time(func):
     def wrapper(*args, **kwargs):
-        start = time.time()
+        start = time.perf_counter()
         result = func(*args, **kwargs)
-        t = time.time() - start
+        t = time.perf_counter() - start
         return result, round(t, 4)
     return wrapper
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.label_names)
+        with self.lock:
+            self.values[key] += amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.label_names)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * len(self.buckets), [0, 0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            total[0] += 1
+            total[1] += value
+            self.series[key] = (counts, total)
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, (counts, (count, total)) in sorted(self.series.items()):
+                for bound, n in zip(self.buckets, counts):
+                    out.append((self.name + "_bucket", key + (repr(bound),), n))
+                out.append((self.name + "_bucket", key + ("+Inf",), count))
+                out.append((self.name + "_count", key, count))
+                out.append((self.name + "_sum", key, total))
+        return out
+
+
+REQUESTS = Counter("sv_requests_total", "Requests handled", ("endpoint", "method", "status"))
+REQUEST_BYTES = Counter("sv_request_bytes_total", "Request body bytes received", ("endpoint",))
+RESPONSE_BYTES = Counter("sv_response_bytes_total", "Response body bytes sent", ("endpoint",))
+IN_FLIGHT = Gauge("sv_requests_in_flight", "Requests currently being handled", ("endpoint",))
+REQUEST_SECONDS = Histogram("sv_request_seconds", "End-to-end request latency", ("endpoint",))
+STAGE_SECONDS = Histogram("sv_stage_seconds", "Latency of individual processing stages",
+                          ("endpoint", "stage"))
+STREAM_ABORTS = Counter("sv_stream_aborts_total",
+                        "Streaming responses cut short after the status was sent", ("endpoint",))
+LOOP_LAG = Histogram("sv_event_loop_lag_seconds",
+                     "Event-loop lag; endpoint=\"all\" is every sample, others are samples taken "
+                     "while that endpoint had requests in flight", ("endpoint",))
+METRICS = (REQUESTS, REQUEST_BYTES, RESPONSE_BYTES, IN_FLIGHT, REQUEST_SECONDS, STAGE_SECONDS,
+           STREAM_ABORTS, LOOP_LAG)
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        names = metric.label_names
+        for sample, key, value in metric.samples():
+            label_names = names + ("le",) if len(key) > len(names) else names
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f"{sample}{_labels(label_names, key)} {value!r}")
+    return "\n".join(lines) + "\n"
+
+
+async def watch_loop_lag(interval=LOOP_LAG_INTERVAL):
+    # Runs for the lifetime of the app (see lifespan in main.py)
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.observe(lag, endpoint="all")
+        for _, (endpoint,), in_flight in IN_FLIGHT.samples():
+            if in_flight > 0:
+                LOOP_LAG.observe(lag, endpoint=endpoint)
+
+
+# ----------------------- Stage timing -----------------------
+
+class RequestMetrics:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.stages = []
+
+
+_request = contextvars.ContextVar("sv_request", default=None)
+_worker = threading.local()
+
+
+def record_stage(name, seconds):
+    collected = getattr(_worker, "stages", None)
+    if collected is not None:
+        collected.append((name, seconds))
+        return
+    request = _request.get()
+    STAGE_SECONDS.observe(seconds, endpoint=request.endpoint if request else "background", stage=name)
+    if request is not None:
+        request.stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def call_collecting(func, *args, **kwargs):
+    # Runs inside a pool worker; returns (result, [(stage, seconds)])
+    _worker.stages = []
+    try:
+        result = func(*args, **kwargs)
+        return result, _worker.stages
+    finally:
+        _worker.stages = None
+
+
+def server_timing(stages, existing=()):
+    # Same-named stages (e.g. one "cipher" per record) are summed
+    totals = {}
+    for name, seconds in stages:
+        if name not in existing:
+            totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware for request counters, byte counters, in-flight gauges,
+    upload_read / response_write stages and the optional Server-Timing header.
+
+    Written against raw ASGI rather than BaseHTTPMiddleware so streaming
+    responses pass through without being buffered.
+    """
+
+    def __init__(self, app, routes=(), server_timing=SERVER_TIMING):
+        self.app = app
+        self.routes = routes
+        self.server_timing = server_timing
+
+    def endpoint(self, scope):
+        # Label by route template so /keys/{key_id} is a single series. A
+        # partial match is a path hit with the wrong method.
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+
+        endpoint = self.endpoint(scope)
+        request = RequestMetrics(endpoint)
+        token = _request.set(request)
+        start = time.perf_counter()
+        state = {"write_start": None, "status": 500}
+        IN_FLIGHT.inc(endpoint=endpoint)
+
+        # FastAPI parses the whole multipart body before the endpoint runs,
+        # so arrival to last body message is the upload (and spooling) time.
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                REQUEST_BYTES.inc(len(message.get("body", b"")), endpoint=endpoint)
+                if not message.get("more_body", False):
+                    record_stage("upload_read", time.perf_counter() - start)
+            return message
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["write_start"] = time.perf_counter()
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    existing = [v.decode() for k, v in headers if k.lower() == b"server-timing"]
+                    names = {part.split(";")[0].strip() for v in existing for part in v.split(",")}
+                    timing = server_timing(request.stages, names)
+                    if timing:
+                        headers.append((b"server-timing", timing.encode()))
+                        message = dict(message, headers=headers)
+            elif message["type"] == "http.response.body":
+                RESPONSE_BYTES.inc(len(message.get("body", b"")), endpoint=endpoint)
+                if not message.get("more_body", False) and state["write_start"] is not None:
+                    record_stage("response_write", time.perf_counter() - state["write_start"])
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive, timed_send)
+        finally:
+            IN_FLIGHT.dec(endpoint=endpoint)
+            REQUESTS.inc(endpoint=endpoint, method=scope["method"], status=state["status"])
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            _request.reset(token)
@@ -0,0 +1,96 @@
+from PIL import Image
+import numpy as np
+import struct
+import zlib
+import os
+
+
+# Minimal streaming PNG encoder: rows are filtered and deflated band by band,
+# so an image can be written without ever holding a second full raster.
+# Only 8-bit L/LA/RGB/RGBA output is supported; "P" images are written as
+# their raw palette indices (mode "L"), which is what np.array + fromarray
+# has always produced for them.
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+COLOR_TYPES = {"L": (0, 1), "P": (0, 1), "LA": (4, 2), "RGB": (2, 3), "RGBA": (6, 4)}
+BAND_BYTES = 8 * 1024 * 1024
+IDAT_SIZE = 256 * 1024
+
+# Pillow refuses images above ~179 MP as decompression bombs; deployments
+# that handle gigapixel scans can raise the limit explicitly.
+if os.environ.get("SV_MAX_IMAGE_PIXELS"):
+    Image.MAX_IMAGE_PIXELS = int(os.environ["SV_MAX_IMAGE_PIXELS"])
+
+
+def can_stream(mode):
+    return mode in COLOR_TYPES
+
+
+def _chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+class PNGStreamWriter:
+    def __init__(self, fp, width, height, mode, compress_level=6):
+        color_type, self.channels = COLOR_TYPES[mode]
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.deflate = zlib.compressobj(compress_level)
+        self.pending = []
+        self.pending_size = 0
+
+        ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+        fp.write(PNG_SIGNATURE + _chunk(b"IHDR", ihdr))
+
+    def _emit(self, data, force=False):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending_size >= IDAT_SIZE or (force and self.pending_size):
+            self.fp.write(_chunk(b"IDAT", b"".join(self.pending)))
+            self.pending = []
+            self.pending_size = 0
+
+    def write_rows(self, rows):
+        # rows: (n, width[, channels]) uint8. Every row uses the Sub filter,
+        # which works within a row and so stays effective on shuffled images.
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), -1)
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:] = rows
+        filtered[:, 1 + self.channels:] -= rows[:, :-self.channels]
+
+        self._emit(self.deflate.compress(filtered.tobytes()))
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"Wrote {self.rows_written} of {self.height} rows")
+        self._emit(self.deflate.flush(), force=True)
+        self.fp.write(_chunk(b"IEND", b""))
+
+
+def band_rows(width, channels):
+    return max(1, BAND_BYTES // max(1, width * channels))
+
+
+def write_rows_in_order(image, order, fp):
+    """Write image as a PNG whose row i is row order[i] of the source.
+
+    The decoded source image is the only full raster held; each output band
+    is gathered from it row by row and handed straight to the encoder.
+    """
+    width, height = image.size
+    writer = PNGStreamWriter(fp, width, height, image.mode)
+    step = band_rows(width, writer.channels)
+
+    for start in range(0, height, step):
+        band = [np.asarray(image.crop((0, int(r), width, int(r) + 1)))[0]
+                for r in order[start:start + step]]
+        writer.write_rows(np.stack(band))
+
+    writer.close()
+    return fp
@@ -0,0 +1,181 @@
+from collections import OrderedDict, defaultdict
+import threading
+import tempfile
+import hashlib
+import hmac
+import json
+import os
+
+from executor import run_blocking
+
+
+# Content-addressed cache for endpoints whose output depends only on the
+# input bytes and parameters. Entries are keyed by
+#   HMAC(secret, endpoint | sha256(input) | canonical params)
+# so parameters such as shuffle keys never appear in memory or on disk in
+# recoverable form, and only outputs are stored. Randomized endpoints
+# (AES/GCM encryption) must not use it.
+
+CACHE_BYTES = int(os.environ.get("SV_RESULT_CACHE_BYTES", 256 * 1024 * 1024))
+CACHE_MAX_ENTRY = int(os.environ.get("SV_RESULT_CACHE_MAX_ENTRY", 16 * 1024 * 1024))
+CACHE_DIR = os.environ.get("SV_RESULT_CACHE_DIR")
+CACHE_DISK_BYTES = int(os.environ.get("SV_RESULT_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+TMP_PREFIX = ".tmp-"
+
+
+class _LRU:
+    # Byte-bounded LRU index. Values are the payload (memory tier) or the
+    # entry size (disk tier).
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value, size):
+        # Returns the keys evicted to make room
+        self.discard(key)
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.bytes += size
+        evicted = []
+        while self.bytes > self.max_bytes and self.entries:
+            old, _ = self.entries.popitem(last=False)
+            self.bytes -= self.sizes.pop(old)
+            evicted.append(old)
+        return evicted
+
+    def discard(self, key):
+        if key in self.entries:
+            del self.entries[key]
+            self.bytes -= self.sizes.pop(key)
+
+
+class ResultCache:
+    def __init__(self, max_bytes=CACHE_BYTES, max_entry=CACHE_MAX_ENTRY,
+                 disk_dir=CACHE_DIR, disk_bytes=CACHE_DISK_BYTES, secret=None):
+        secret = secret or os.environ.get("SV_RESULT_CACHE_SECRET")
+        # Without a configured secret the disk tier only serves the current
+        # process, since keys from an earlier run can't be reproduced.
+        self.secret = secret.encode() if isinstance(secret, str) else (secret or os.urandom(32))
+        self.max_entry = max_entry
+        self.memory = _LRU(max_bytes)
+        self.disk = _LRU(disk_bytes) if disk_dir else None
+        self.disk_dir = disk_dir
+        self.lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.disk_hits = 0
+
+        if self.disk is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            files = []
+            for name in os.listdir(disk_dir):
+                path = os.path.join(disk_dir, name)
+                if name.startswith(TMP_PREFIX):
+                    # Left behind by a write that never finished
+                    self._remove(name)
+                elif len(name) == 64 and os.path.isfile(path):
+                    files.append((os.path.getmtime(path), name, os.path.getsize(path)))
+            for _, name, size in sorted(files):
+                for old in self.disk.put(name, size, size):
+                    self._remove(old)
+
+    def key(self, endpoint, input_digest, **params):
+        material = json.dumps([endpoint, input_digest, params], sort_keys=True, default=str)
+        return hmac.new(self.secret, material.encode(), hashlib.sha256).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, endpoint, key):
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.hits[endpoint] += 1
+                return value
+            on_disk = self.disk is not None and self.disk.get(key) is not None
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as fp:
+                    value = fp.read()
+            except OSError:
+                value = None
+            with self.lock:
+                if value is None:
+                    self.disk.discard(key)
+                else:
+                    self.disk_hits += 1
+                    self.hits[endpoint] += 1
+                    self.memory.put(key, value, len(value))
+                    return value
+
+        with self.lock:
+            self.misses[endpoint] += 1
+        return None
+
+    def put(self, key, value):
+        if len(value) > self.max_entry:
+            return
+        with self.lock:
+            self.memory.put(key, value, len(value))
+
+        if self.disk is not None:
+            # Unique temp file per writer: identical concurrent requests each
+            # write their own and the last os.replace wins. A failed disk
+            # write only costs the disk copy; the request still succeeds.
+            tmp = None
+            try:
+                fd, tmp = tempfile.mkstemp(prefix=TMP_PREFIX, dir=self.disk_dir)
+                with os.fdopen(fd, "wb") as fp:
+                    fp.write(value)
+                os.replace(tmp, self._path(key))
+            except OSError:
+                if tmp is not None:
+                    self._remove(os.path.basename(tmp))
+                return
+            with self.lock:
+                evicted = self.disk.put(key, len(value), len(value))
+            for old in evicted:
+                self._remove(old)
+
+    async def aget(self, endpoint, key):
+        if self.disk is None:
+            return self.get(endpoint, key)
+        return await run_blocking("stream", self.get, endpoint, key)
+
+    async def aput(self, key, value):
+        if self.disk is None:
+            return self.put(key, value)
+        return await run_blocking("stream", self.put, key, value)
+
+    def stats(self):
+        with self.lock:
+            endpoints = sorted(set(self.hits) | set(self.misses))
+            return {
+                "endpoints": {name: {"hits": self.hits[name], "misses": self.misses[name]}
+                              for name in endpoints},
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "memory": {"entries": len(self.memory.entries), "bytes": self.memory.bytes,
+                           "max_bytes": self.memory.max_bytes},
+                "disk": None if self.disk is None else {
+                    "entries": len(self.disk.entries), "bytes": self.disk.bytes,
+                    "max_bytes": self.disk.max_bytes, "hits": self.disk_hits},
+            }
+
+
+result_cache = ResultCache()
@@ -1,27 +1,281 @@
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
+from Crypto.Signature import pkcs1_15, eddsa, DSS
+from Crypto.Hash import SHA256, SHA512
+from Crypto.PublicKey import RSA, ECC
+from collections import OrderedDict
+import threading
+import secrets
+import time
+import os
 
+from metrics import stage
 
-def generate_rsa_keys():
-    key = RSA.generate(2048)
+
+# Supported key types. RSA (PKCS#1 v1.5) stays the default; Ed25519 and
+# ECDSA P-256 keys generate in microseconds and sign far faster. The scheme is
+# a property of the key, so sign/verify detect it from the PEM.
+SIGNATURE_ALGORITHMS = ("rsa", "ed25519", "ecdsa-p256")
+CURVES = {"ed25519": "Ed25519", "ecdsa-p256": "NIST P-256"}
+
+# Pre-hashed mode: the upload is streamed through one of these and only the
+# digest is signed. Ed25519 pre-hashing is Ed25519ph, which is defined over
+# SHA-512 only.
+PREHASH_ALGORITHMS = {"sha256": SHA256, "sha512": SHA512}
+
+
+def generate_rsa_keys(bits=2048):
+    key = RSA.generate(bits)
     private_key = key.export_key()
     public_key = key.publickey().export_key()
     return private_key, public_key
 
 
-def sign_data(data: bytes, private_key_bytes: bytes):
-    private_key = RSA.import_key(private_key_bytes)
-    h = SHA256.new(data)
-    signature = pkcs1_15.new(private_key).sign(h)
-    return signature
+def generate_keys(algorithm="rsa", bits=2048):
+    if algorithm == "rsa":
+        return generate_rsa_keys(bits)
+    if algorithm not in CURVES:
+        raise ValueError(f"Unsupported signature algorithm '{algorithm}'")
+    key = ECC.generate(curve=CURVES[algorithm])
+    return key.export_key(format="PEM").encode(), key.public_key().export_key(format="PEM").encode()
 
 
-def verify_signature(data: bytes, signature: bytes, public_key_bytes: bytes):
-    public_key = RSA.import_key(public_key_bytes)
-    h = SHA256.new(data)
+def import_signing_key(pem: bytes):
     try:
-        pkcs1_15.new(public_key).verify(h, signature)
-        return True
-    except:
+        return RSA.import_key(pem)
+    except (ValueError, IndexError, TypeError):
+        return ECC.import_key(pem)
+
+
+def key_algorithm(key):
+    if isinstance(key, RSA.RsaKey):
+        return "rsa"
+    for name, curve in CURVES.items():
+        if key.curve == curve:
+            return name
+    raise ValueError(f"Unsupported curve '{key.curve}'")
+
+
+def public_half(key):
+    return key.publickey() if isinstance(key, RSA.RsaKey) else key.public_key()
+
+
+def export_public(key):
+    public = public_half(key)
+    return public.export_key() if isinstance(public, RSA.RsaKey) else public.export_key(format="PEM").encode()
+
+
+def new_scheme(key):
+    # pkcs1_15 / eddsa / DSS signer or verifier object for key
+    algorithm = key_algorithm(key)
+    if algorithm == "rsa":
+        return pkcs1_15.new(key)
+    if algorithm == "ed25519":
+        return eddsa.new(key, "rfc8032")
+    return DSS.new(key, "fips-186-3")
+
+
+def new_prehash(name, algorithm="rsa"):
+    if name not in PREHASH_ALGORITHMS:
+        raise ValueError(f"Unsupported pre-hash '{name}'")
+    if algorithm == "ed25519" and name != "sha512":
+        raise ValueError("Ed25519 pre-hashed signatures (Ed25519ph) require sha512")
+    return PREHASH_ALGORITHMS[name].new()
+
+
+def _message(scheme, data):
+    # Ed25519 signs the message itself; RSA and ECDSA sign its SHA-256.
+    # Hash objects (pre-hashed mode) are passed through.
+    if isinstance(data, (bytes, bytearray, memoryview)) and not isinstance(scheme, eddsa.EdDSASigScheme):
+        return SHA256.new(data)
+    return data
+
+
+def sign_with_scheme(scheme, data):
+    with stage("sign"):
+        return scheme.sign(_message(scheme, data))
+
+
+def verify_with_scheme(scheme, data, signature):
+    with stage("verify"):
+        try:
+            scheme.verify(_message(scheme, data), signature)
+            return True
+        except ValueError:
+            return False
+
+
+def sign_data(data, private_key_bytes: bytes):
+    # data is the payload, or a hash object in pre-hashed mode
+    private_key = import_signing_key(private_key_bytes)
+    return sign_with_scheme(new_scheme(private_key), data)
+
+
+def verify_signature(data, signature: bytes, public_key_bytes: bytes):
+    try:
+        public_key = import_signing_key(public_key_bytes)
+    except (ValueError, IndexError, TypeError):
         return False
+    return verify_with_scheme(new_scheme(public_half(public_key)), data, signature)
+
+
+def pem_algorithm(pem: bytes):
+    return key_algorithm(import_signing_key(pem))
+
+
+# ----------------------- Key registry -----------------------
+#
+# Clients upload or generate a key once and then sign/verify by key ID, so
+# neither the PEM transfer nor key parsing is paid per request. PEMs are
+# kept for every registered key; parsed keys and their signer / verifier
+# objects live in a bounded LRU in front of that.
+#
+# Registration is unauthenticated, so entries expire after
+# KEY_REGISTRY_TTL seconds without use, and a full registry makes room by
+# evicting the least recently used public-only entry (anyone holding the
+# public PEM can register it again). Private keys are only dropped by
+# expiry, since their IDs can't be recreated.
+
+KEY_REGISTRY_MAX = int(os.environ.get("SV_KEY_REGISTRY_MAX", 10000))
+KEY_REGISTRY_TTL = int(os.environ.get("SV_KEY_REGISTRY_TTL", 24 * 3600))
+PARSED_KEY_CACHE = int(os.environ.get("SV_PARSED_KEY_CACHE", 128))
+
+
+class KeyRegistry:
+    def __init__(self, max_keys=KEY_REGISTRY_MAX, cache_size=PARSED_KEY_CACHE, ttl=KEY_REGISTRY_TTL):
+        self.max_keys = max_keys
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.pems = OrderedDict()   # least recently used first
+        self.expires = {}
+        self.delete_tokens = {}     # public-only key_id -> token needed to delete it
+        self.evicted = 0
+        self.parsed = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, pem: bytes):
+        """Store a key; returns (key_id, delete_token, has_private, algorithm).
+
+        A private key gets a random, unguessable key_id that only the caller
+        learns: it is the capability to sign with the key and to delete it.
+        A public key's ID is its SHA-256 fingerprint, so registering it twice
+        maps to one entry; the first registration gets a delete_token, later
+        ones get None.
+        """
+        key = import_signing_key(pem)
+        has_private = key.has_private()
+        if has_private:
+            key_id = secrets.token_urlsafe(32)
+        else:
+            key_id = SHA256.new(key.export_key(format="DER")).hexdigest()[:32]
+
+        with self.lock:
+            now = time.monotonic()
+            if self._lookup(key_id, now) is not None:
+                return key_id, None, False, key_algorithm(key)
+            if not self._make_room(now):
+                raise ValueError("Key registry is full")
+            if has_private:
+                self.pems[key_id] = pem
+                token = None
+            else:
+                self.pems[key_id] = export_public(key)
+                token = self.delete_tokens[key_id] = secrets.token_urlsafe(32)
+            self.expires[key_id] = now + self.ttl
+        return key_id, token, has_private, key_algorithm(key)
+
+    # The helpers below expect self.lock to be held.
+
+    def _drop(self, key_id):
+        del self.pems[key_id]
+        del self.expires[key_id]
+        self.delete_tokens.pop(key_id, None)
+        self.parsed.pop(key_id, None)
+
+    def _lookup(self, key_id, now):
+        # PEM of a live entry, renewing its expiry; None if unknown or expired
+        pem = self.pems.get(key_id)
+        if pem is None:
+            return None
+        if self.expires[key_id] < now:
+            self._drop(key_id)
+            return None
+        self.pems.move_to_end(key_id)
+        self.expires[key_id] = now + self.ttl
+        return pem
+
+    def _make_room(self, now):
+        if len(self.pems) < self.max_keys:
+            return True
+        for key_id in [k for k, expires in self.expires.items() if expires < now]:
+            self._drop(key_id)
+        if len(self.pems) < self.max_keys:
+            return True
+        victim = next((k for k in self.pems if k in self.delete_tokens), None)
+        if victim is None:
+            return False
+        self._drop(victim)
+        self.evicted += 1
+        return True
+
+    def _entry(self, key_id):
+        with self.lock:
+            pem = self._lookup(key_id, time.monotonic())
+            entry = self.parsed.get(key_id)
+            if entry is not None:
+                self.parsed.move_to_end(key_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        if pem is None:
+            raise KeyError(key_id)
+
+        key = import_signing_key(pem)
+        entry = (new_scheme(key) if key.has_private() else None,
+                 new_scheme(public_half(key)), key_algorithm(key))
+        with self.lock:
+            self.parsed[key_id] = entry
+            while len(self.parsed) > self.cache_size:
+                self.parsed.popitem(last=False)
+        return entry
+
+    def algorithm(self, key_id):
+        return self._entry(key_id)[2]
+
+    def sign(self, key_id, data):
+        signer, _, _ = self._entry(key_id)
+        if signer is None:
+            raise ValueError("Key has no private half")
+        return sign_with_scheme(signer, data)
+
+    def verify(self, key_id, data, signature: bytes):
+        _, verifier, _ = self._entry(key_id)
+        return verify_with_scheme(verifier, data, signature)
+
+    def public_key(self, key_id):
+        with self.lock:
+            pem = self._lookup(key_id, time.monotonic())
+        if pem is None:
+            raise KeyError(key_id)
+        return export_public(import_signing_key(pem))
+
+    def remove(self, key_id, delete_token=None):
+        # A private key's ID is itself the secret; public-only entries have
+        # guessable IDs and need the token issued at registration.
+        with self.lock:
+            if self._lookup(key_id, time.monotonic()) is None:
+                return False
+            expected = self.delete_tokens.get(key_id)
+            if expected is not None and not secrets.compare_digest(expected, delete_token or ""):
+                raise PermissionError(key_id)
+            self._drop(key_id)
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {"keys": len(self.pems), "max_keys": self.max_keys, "ttl_seconds": self.ttl,
+                    "evicted": self.evicted, "parsed": len(self.parsed),
+                    "cache_size": self.cache_size, "hits": self.hits, "misses": self.misses}
+
+
+key_registry = KeyRegistry()
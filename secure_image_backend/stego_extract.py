@@ -1,28 +1,128 @@
 from PIL import Image
+import numpy as np
+import struct
+import zlib
 import io
 
+from metrics import stage
+from stego_hide import (END_MARKER, STEGO_MAGIC, STEGO_VERSION, HEADER_FORMAT, HEADER_BITS,
+                        FLAG_COMPRESSED, FLAG_TEXT, MIN_BITS_PER_CHANNEL, MAX_BITS_PER_CHANNEL,
+                        MAX_DECOMPRESSED_SIZE)
+
+
+MARKER = END_MARKER.encode("ascii")
+BLOCK_PIXELS = 1 << 16
+
+
+def iter_lsb_blocks(img, block_pixels=BLOCK_PIXELS):
+    # Yield the channel LSBs of an image as ASCII '0'/'1' bytes, a band of
+    # rows at a time, so callers can stop before touching the rest.
+    width, height = img.size
+    rows = max(1, block_pixels // width)
+
+    for top in range(0, height, rows):
+        band = img.crop((0, top, width, min(top + rows, height)))
+        if band.mode != "RGB":
+            band = band.convert("RGB")
+        bits = np.array(band).reshape(-1) & 1
+        yield (bits + ord("0")).tobytes()
 
-def extract_message(image_bytes):
-    img = Image.open(io.BytesIO(image_bytes))
-    img = img.convert("RGB")
 
-    data = list(img.getdata())
-    binary = ""
+def find_payload_bits(img):
+    # Incremental search for the end marker: each block is only scanned
+    # together with the last len(MARKER) - 1 bits of the previous one.
+    chunks = []
+    seen = 0
+    tail = b""
 
-    for pixel in data:
-        r, g, b = pixel
-        binary += str(r & 1)
-        binary += str(g & 1)
-        binary += str(b & 1)
+    for block in iter_lsb_blocks(img):
+        window = tail + block
+        pos = window.find(MARKER)
+        if pos != -1:
+            end = seen - len(tail) + pos
+            chunks.append(block)
+            return b"".join(chunks)[:end]
 
-        if "1111111111111110" in binary:
-            break
+        chunks.append(block)
+        seen += len(block)
+        tail = window[-(len(MARKER) - 1):]
 
-    binary = binary.split("1111111111111110")[0]
+    return b"".join(chunks)
 
-    msg = ""
-    for i in range(0, len(binary), 8):
-        byte = binary[i:i+8]
-        msg += chr(int(byte, 2))
 
+def bits_to_message(bits):
+    whole = len(bits) - len(bits) % 8
+    arr = np.frombuffer(bits[:whole], dtype=np.uint8) - ord("0")
+    msg = np.packbits(arr).tobytes().decode("latin-1")
+
+    if whole < len(bits):
+        msg += chr(int(bits[whole:], 2))
     return msg
+
+
+def extract_message(image_bytes):
+    with stage("decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
+    with stage("stego"):
+        return bits_to_message(find_payload_bits(img))
+
+
+def read_values(img, offset, count, bits_per_channel=1):
+    # Low bits of channels [offset, offset + count), cropping only the rows
+    # that hold them.
+    width, height = img.size
+    row_channels = width * 3
+    end = offset + count
+    if end > row_channels * height:
+        raise ValueError("Stego payload runs past the end of the image")
+
+    top = offset // row_channels
+    bottom = -(-end // row_channels)
+    band = img.crop((0, top, width, bottom))
+    if band.mode != "RGB":
+        band = band.convert("RGB")
+
+    start = offset - top * row_channels
+    return np.array(band).reshape(-1)[start:start + count] & ((1 << bits_per_channel) - 1)
+
+
+def values_to_bytes(values, bits_per_channel, length):
+    shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+    bits = ((values[:, None] >> shifts) & 1).reshape(-1)
+    return np.packbits(bits[:length * 8]).tobytes()
+
+
+def extract_payload(image_bytes):
+    with stage("decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
+    with stage("stego"):
+        return read_payload(img)
+
+
+def read_payload(img):
+    header = values_to_bytes(read_values(img, 0, HEADER_BITS), 1, HEADER_BITS // 8)
+    magic, version, bits_per_channel, flags, length = struct.unpack(HEADER_FORMAT, header)
+    if magic != STEGO_MAGIC:
+        raise ValueError("No stego container found in image")
+    if version != STEGO_VERSION:
+        raise ValueError(f"Unsupported stego container version {version}")
+    if not MIN_BITS_PER_CHANNEL <= bits_per_channel <= MAX_BITS_PER_CHANNEL:
+        raise ValueError("Corrupt stego header")
+
+    count = -(-length * 8 // bits_per_channel)
+    payload = values_to_bytes(read_values(img, HEADER_BITS, count, bits_per_channel),
+                              bits_per_channel, length)
+
+    if flags & FLAG_COMPRESSED:
+        inflater = zlib.decompressobj()
+        try:
+            payload = inflater.decompress(payload, MAX_DECOMPRESSED_SIZE)
+        except zlib.error:
+            raise ValueError("Corrupt compressed stego payload")
+        if inflater.unconsumed_tail:
+            raise ValueError(f"Compressed stego payload inflates past {MAX_DECOMPRESSED_SIZE} bytes")
+        if not inflater.eof:
+            raise ValueError("Corrupt compressed stego payload")
+    return payload, bool(flags & FLAG_TEXT)
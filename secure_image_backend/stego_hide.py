@@ -1,37 +1,136 @@
 from PIL import Image
+import numpy as np
+import struct
+import zlib
 import io
+import os
+
+from metrics import stage
+
+
+END_MARKER = "1111111111111110"
+
+# Versioned container: a fixed header stored at 1 bit per channel, followed
+# by the payload at the bits-per-channel recorded in the header.
+#   magic(3) | version(1) | bits_per_channel(1) | flags(1) | length(4)
+STEGO_MAGIC = b"SVS"
+STEGO_VERSION = 1
+HEADER_FORMAT = ">3sBBBI"
+HEADER_BITS = struct.calcsize(HEADER_FORMAT) * 8
+
+FLAG_COMPRESSED = 0x01
+FLAG_TEXT = 0x02
+
+MIN_BITS_PER_CHANNEL = 1
+MAX_BITS_PER_CHANNEL = 4
+
+# Extraction refuses to inflate a compressed payload past this size, so a
+# small crafted image can't expand into gigabytes; larger payloads are
+# embedded uncompressed.
+MAX_DECOMPRESSED_SIZE = int(os.environ.get("SV_STEGO_MAX_DECOMPRESSED", 64 * 1024 * 1024))
+
+
+def message_to_bits(message):
+    # Fast path: every char fits in one byte, so unpackbits gives the
+    # same 8-bit big-endian groups as format(ord(c), '08b').
+    try:
+        raw = message.encode("latin-1")
+    except UnicodeEncodeError:
+        binary = ''.join(format(ord(i), '08b') for i in message)
+        bits = np.frombuffer(binary.encode("ascii"), dtype=np.uint8) - ord("0")
+    else:
+        bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8))
+
+    marker = np.frombuffer(END_MARKER.encode("ascii"), dtype=np.uint8) - ord("0")
+    return np.concatenate([bits, marker])
+
+
+def bytes_to_values(data, bits_per_channel):
+    # Split a byte string into MSB-first groups of bits_per_channel bits.
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    pad = -len(bits) % bits_per_channel
+    if pad:
+        bits = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)])
+
+    weights = (1 << np.arange(bits_per_channel - 1, -1, -1)).astype(np.uint8)
+    return bits.reshape(-1, bits_per_channel) @ weights
+
+
+def embed_values(img, values, offset=0, bits_per_channel=1):
+    # Write values into the low bits of channels [offset, offset + len(values))
+    # of an RGB image, in place. Only the rows that carry payload are copied out.
+    width, height = img.size
+    end = min(offset + len(values), width * height * 3)
+    values = values[:max(0, end - offset)]
+    if len(values) == 0:
+        return img
+
+    row_channels = width * 3
+    top = offset // row_channels
+    bottom = -(-end // row_channels)
+    region = np.array(img.crop((0, top, width, bottom)))
+
+    start = offset - top * row_channels
+    mask = np.uint8((0xFF << bits_per_channel) & 0xFF)
+    flat = region.reshape(-1)
+    flat[start:start + len(values)] = (flat[start:start + len(values)] & mask) | values
+
+    img.paste(Image.fromarray(region, "RGB"), (0, top))
+    return img
+
+
+def stego_capacity(width, height, bits_per_channel=1):
+    # Payload bytes that fit after the header at the given bit depth.
+    channels = width * height * 3 - HEADER_BITS
+    return max(0, channels * bits_per_channel // 8)
 
 
 def hide_message_in_image(image_bytes, message):
-    img = Image.open(io.BytesIO(image_bytes))
-    img = img.convert("RGB")
+    with stage("decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img = img.convert("RGB")
 
-    binary_msg = ''.join(format(ord(i), '08b') for i in message) + "1111111111111110"
+    with stage("stego"):
+        embed_values(img, message_to_bits(message))
+
+    with stage("png_encode"):
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+    return buffer.getvalue()
 
-    data = list(img.getdata())
-    new_data = []
 
-    msg_index = 0
+def embed_payload(img, payload, bits_per_channel=1, compress=False, is_text=False):
+    # Write a versioned stego container into an RGB image, in place.
+    if not MIN_BITS_PER_CHANNEL <= bits_per_channel <= MAX_BITS_PER_CHANNEL:
+        raise ValueError(f"bits_per_channel must be between {MIN_BITS_PER_CHANNEL} and {MAX_BITS_PER_CHANNEL}")
 
-    for pixel in data:
-        r, g, b = pixel
+    flags = FLAG_TEXT if is_text else 0
+    if compress and len(payload) <= MAX_DECOMPRESSED_SIZE:
+        packed = zlib.compress(payload, 9)
+        # Only keep the compressed form when it actually saves pixels
+        if len(packed) < len(payload):
+            payload = packed
+            flags |= FLAG_COMPRESSED
 
-        if msg_index < len(binary_msg):
-            r = (r & ~1) | int(binary_msg[msg_index])
-            msg_index += 1
+    capacity = stego_capacity(*img.size, bits_per_channel)
+    if len(payload) > capacity:
+        raise ValueError(f"Payload of {len(payload)} bytes exceeds image capacity of {capacity} bytes")
 
-        if msg_index < len(binary_msg):
-            g = (g & ~1) | int(binary_msg[msg_index])
-            msg_index += 1
+    header = struct.pack(HEADER_FORMAT, STEGO_MAGIC, STEGO_VERSION, bits_per_channel, flags, len(payload))
+    embed_values(img, bytes_to_values(header, 1))
+    embed_values(img, bytes_to_values(payload, bits_per_channel), HEADER_BITS, bits_per_channel)
+    return img
 
-        if msg_index < len(binary_msg):
-            b = (b & ~1) | int(binary_msg[msg_index])
-            msg_index += 1
 
-        new_data.append((r, g, b))
+def hide_payload_in_image(image_bytes, payload, bits_per_channel=1, compress=False, is_text=False):
+    with stage("decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img = img.convert("RGB")
 
-    img.putdata(new_data)
+    with stage("stego"):
+        embed_payload(img, payload, bits_per_channel, compress, is_text)
 
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
+    with stage("png_encode"):
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
     return buffer.getvalue()
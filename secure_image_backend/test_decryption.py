@@ -0,0 +1,45 @@
+import pytest
+
+from encryption import derive_aes_key, encrypt_image_aes, CBCStreamEncryptor, CBC_MAGIC
+from decryption import decrypt_image_aes, CBCStreamDecryptor
+
+
+# Written by the baseline encrypt_image_aes (space padding, no marker) with
+# password "baseline" and iv 00..0f.
+BASELINE_PKCS7_LOOKALIKE = bytes.fromhex(
+    "000102030405060708090a0b0c0d0e0f026d3f43272f99e1cd0d00a3138d9777")
+BASELINE_SPACE_PADDED = bytes.fromhex(
+    "000102030405060708090a0b0c0d0e0fea8a357ab9edcfce2069bd27e7de0a88"
+    "54b8886df449e367548fb6f2d498487c")
+
+
+def test_baseline_file_keeps_pkcs7_lookalike_bytes():
+    assert decrypt_image_aes(BASELINE_PKCS7_LOOKALIKE, "baseline") == b"A" * 15 + b"\x01"
+
+
+def test_baseline_file_decrypts_as_before():
+    assert decrypt_image_aes(BASELINE_SPACE_PADDED, "baseline") == b"legacy image bytes" + b" " * 14
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 17, 1000])
+def test_round_trip(size):
+    data = bytes(range(256)) * 4
+    enc = encrypt_image_aes(data[:size], "pw")
+    assert enc.startswith(CBC_MAGIC)
+    assert decrypt_image_aes(enc, "pw") == data[:size]
+
+
+def test_streamed_in_small_chunks():
+    data = b"x" * 100
+    enc = encrypt_image_aes(data, "pw")
+    decryptor = CBCStreamDecryptor(derive_aes_key("pw"))
+    out = b"".join(decryptor.update(enc[i:i + 3]) for i in range(0, len(enc), 3))
+    assert out + decryptor.finalize() == data
+
+
+def test_bad_padding_is_rejected():
+    # Fixed iv so the wrong-key plaintext is not valid PKCS#7 by chance
+    encryptor = CBCStreamEncryptor(derive_aes_key("pw"), iv=bytes(16))
+    enc = encryptor.header + encryptor.update(b"secret") + encryptor.finalize()
+    with pytest.raises(ValueError):
+        decrypt_image_aes(enc, "wrong")
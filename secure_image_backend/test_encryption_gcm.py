@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from encryption_gcm import (GCMStreamEncryptor, GCMStreamDecryptor, SegmentError, encrypt_stream,
+                            encrypt_aes_gcm, decrypt_aes_gcm_any, seal_record, key_cache,
+                            session_store, AEADS, STREAM_MAGIC, TAG_SIZE)
+
+
+PASSWORD = "pw"
+RECORD_SIZE = 1000
+DATA = os.urandom(RECORD_SIZE * 5 + 123)
+
+
+def legacy_container(version, data, algorithm="aes-gcm", record_size=RECORD_SIZE):
+    # v1/v2 as earlier releases wrote them: records sealed with the PBKDF2
+    # key itself, v1 without the AEAD byte
+    salt, prefix = os.urandom(16), os.urandom(7)
+    aead = b"" if version == 1 else bytes([AEADS[algorithm]])
+    header = (STREAM_MAGIC + bytes([version]) + aead + record_size.to_bytes(4, "big") +
+              salt + prefix)
+    context = (algorithm, key_cache.derive(PASSWORD, salt), header, prefix)
+    chunks = [data[i:i + record_size] for i in range(0, len(data), record_size)]
+    if not chunks or len(chunks[-1]) == record_size:
+        chunks.append(b"")
+    return header + b"".join(seal_record(context, (i, i == len(chunks) - 1, chunk))
+                             for i, chunk in enumerate(chunks))
+
+
+def container(algorithm="aes-gcm", data=DATA):
+    encryptor = GCMStreamEncryptor(PASSWORD, record_size=RECORD_SIZE, algorithm=algorithm)
+    return encryptor.header + encryptor.update(data) + encryptor.finalize()
+
+
+def records(enc):
+    # (header, [records]) of a v2/v3 container with RECORD_SIZE records
+    header, body = enc[:33], enc[33:]
+    full = RECORD_SIZE + TAG_SIZE
+    return header, [body[i:i + full] for i in range(0, len(body), full)]
+
+
+@pytest.mark.parametrize("algorithm", list(AEADS))
+@pytest.mark.parametrize("size", [0, 1, RECORD_SIZE, RECORD_SIZE * 3, len(DATA)])
+def test_v3_round_trip(algorithm, size):
+    enc = container(algorithm, DATA[:size])
+    assert enc[4] == 3
+    assert decrypt_aes_gcm_any(enc, PASSWORD) == DATA[:size]
+
+
+@pytest.mark.parametrize("version,algorithm", [(1, "aes-gcm"), (2, "aes-gcm"), (2, "chacha20-poly1305")])
+def test_legacy_round_trip(version, algorithm):
+    assert decrypt_aes_gcm_any(legacy_container(version, DATA, algorithm), PASSWORD) == DATA
+
+
+def test_streamed_in_small_chunks():
+    enc = container()
+    decryptor = GCMStreamDecryptor(PASSWORD)
+    out = b"".join(decryptor.update(enc[i:i + 7]) for i in range(0, len(enc), 7))
+    assert out + decryptor.finalize() == DATA
+
+
+def test_encrypt_stream_and_single_shot():
+    assert decrypt_aes_gcm_any(encrypt_stream(DATA, PASSWORD, "chacha20-poly1305"), PASSWORD) == DATA
+    assert decrypt_aes_gcm_any(encrypt_aes_gcm(DATA, PASSWORD), PASSWORD) == DATA
+
+
+def test_shared_salt_streams_use_distinct_keys():
+    salt = session_store.salt(PASSWORD, session_store.open())
+    a = GCMStreamEncryptor(PASSWORD, salt=salt)
+    b = GCMStreamEncryptor(PASSWORD, salt=salt)
+    assert a.context[1] != b.context[1]
+
+
+def test_wrong_password_is_rejected():
+    with pytest.raises(SegmentError):
+        decrypt_aes_gcm_any(container(), "wrong")
+
+
+@pytest.mark.parametrize("offset", [0, RECORD_SIZE + TAG_SIZE + 5, -1])
+def test_tampered_record_is_rejected(offset):
+    enc = bytearray(container())
+    enc[33 + offset if offset >= 0 else offset] ^= 1
+    with pytest.raises(SegmentError):
+        decrypt_aes_gcm_any(bytes(enc), PASSWORD)
+
+
+def test_tampered_header_is_rejected():
+    enc = bytearray(container())
+    enc[20] ^= 1  # inside the salt
+    with pytest.raises(ValueError):
+        decrypt_aes_gcm_any(bytes(enc), PASSWORD)
+
+
+def test_reordered_records_are_rejected():
+    header, recs = records(container())
+    recs[1], recs[2] = recs[2], recs[1]
+    with pytest.raises(SegmentError) as e:
+        decrypt_aes_gcm_any(header + b"".join(recs), PASSWORD)
+    assert e.value.segment == 1
+
+
+@pytest.mark.parametrize("keep", [1, 3, 5])
+def test_missing_final_record_is_rejected(keep):
+    # Dropping whole records leaves a well-formed prefix; only the final flag
+    # catches it
+    header, recs = records(container())
+    with pytest.raises(ValueError):
+        decrypt_aes_gcm_any(header + b"".join(recs[:keep]), PASSWORD)
+
+
+def test_missing_empty_final_record_is_rejected():
+    enc = container(data=DATA[:RECORD_SIZE * 2])
+    with pytest.raises(ValueError):
+        decrypt_aes_gcm_any(enc[:-TAG_SIZE], PASSWORD)
+
+
+def test_truncated_header_is_rejected():
+    decryptor = GCMStreamDecryptor(PASSWORD)
+    decryptor.update(container()[:20])
+    with pytest.raises(ValueError):
+        decryptor.finalize()
@@ -0,0 +1,54 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from encryption_gcm import encrypt_stream, HEADER_SIZES, STREAM_VERSION, DEFAULT_RECORD_SIZE, TAG_SIZE
+
+
+PASSWORD = "pw"
+# 48 records, so records 20 and up arrive after the first 1 MiB read
+DATA = bytes(range(256)) * 12288
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def container():
+    return encrypt_stream(DATA, PASSWORD)
+
+
+def record_offset(index):
+    return HEADER_SIZES[STREAM_VERSION] + index * (DEFAULT_RECORD_SIZE + TAG_SIZE)
+
+
+def decrypt(client, enc, password=PASSWORD):
+    return client.post("/decrypt/aes-gcm", files={"file": ("enc", enc)}, data={"password": password})
+
+
+def test_gcm_round_trip(client):
+    response = client.post("/encrypt/aes-gcm", files={"file": ("x", DATA)},
+                           data={"password": PASSWORD, "parallel": "true"})
+    assert decrypt(client, response.content).content == DATA
+
+
+def test_gcm_wrong_password_is_400(client, container):
+    assert decrypt(client, container, "wrong").status_code == 400
+
+
+# Past the first read the status is already sent; a bad stream must abort
+# the response rather than end it as a shorter, complete-looking 200.
+
+def test_gcm_tampered_segment_aborts_stream(client, container):
+    enc = bytearray(container)
+    enc[record_offset(30) + 5] ^= 1
+    with pytest.raises(ValueError):
+        decrypt(client, bytes(enc))
+
+
+def test_gcm_truncated_stream_aborts(client, container):
+    with pytest.raises(ValueError):
+        decrypt(client, container[:record_offset(20)])
@@ -1,4 +1,14 @@
 import hashlib
 
+HASH_ALGORITHMS = ("sha256", "sha512", "blake2b")
+
+
 def generate_sha256(data):
     return hashlib.sha256(data).hexdigest()
+
+
+def new_hashers(algorithms=HASH_ALGORITHMS):
+    unknown = [name for name in algorithms if name not in HASH_ALGORITHMS]
+    if unknown:
+        raise ValueError(f"Unsupported hash algorithm(s): {', '.join(unknown)}")
+    return {name: hashlib.new(name) for name in algorithms}
@@ -1,22 +1,98 @@
 from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
+from collections import OrderedDict
+import threading
 import io
+import os
 
-def add_watermark(image_bytes, text):
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
-    watermark = Image.new("RGBA", img.size)
-    draw = ImageDraw.Draw(watermark)
+from metrics import stage
 
-    font_size = int(min(img.size) / 12)
+
+WATERMARK_ALPHA = 180
+# Rendered layers are sized by the client's text and the image size, so the
+# cache is bounded by bytes, not entries; a layer bigger than a quarter of
+# the budget is rendered for its request and not kept.
+LAYER_CACHE_BYTES = int(os.environ.get("SV_WATERMARK_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+@lru_cache(maxsize=64)
+def load_font(font_size):
     try:
-        font = ImageFont.truetype("arial.ttf", font_size)
+        return ImageFont.truetype("arial.ttf", font_size)
     except:
-        font = ImageFont.load_default()
+        return ImageFont.load_default()
+
+
+_layers = OrderedDict()
+_layers_bytes = 0
+_layers_lock = threading.Lock()
+
+
+def render_text_layer(text, font_size, alpha=WATERMARK_ALPHA):
+    """Render text once into a layer just big enough to hold it.
+
+    Returns (layer, (dx, dy)) where (dx, dy) is the layer's offset from the
+    text anchor. Cached layers are shared, so callers must not modify them.
+    """
+    global _layers_bytes
+    key = (text, font_size, alpha)
+    with _layers_lock:
+        cached = _layers.get(key)
+        if cached is not None:
+            _layers.move_to_end(key)
+            return cached
+
+    font = load_font(font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text, font=font)
 
+    layer = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(layer).text((-left, -top), text, fill=(255, 255, 255, alpha), font=font)
+    result = (layer, (left, top))
+
+    size = layer.width * layer.height * 4
+    if size <= LAYER_CACHE_BYTES // 4:
+        with _layers_lock:
+            if key not in _layers:
+                _layers[key] = result
+                _layers_bytes += size
+            while _layers_bytes > LAYER_CACHE_BYTES:
+                _, (old, _) = _layers.popitem(last=False)
+                _layers_bytes -= old.width * old.height * 4
+    return result
+
+
+def stamp(img, text, alpha=WATERMARK_ALPHA):
+    """Return img as RGB with text blended in, compositing only the text's box.
+
+    RGB images are stamped in place; other modes are converted first.
+    """
     width, height = img.size
-    draw.text((width - width//3, height - height//6), text,
-              fill=(255, 255, 255, 180), font=font)
+    font_size = int(min(img.size) / 12)
+    layer, (dx, dy) = render_text_layer(text, font_size, alpha)
+
+    x, y = width - width // 3 + dx, height - height // 6 + dy
+    box = (max(x, 0), max(y, 0), min(x + layer.width, width), min(y + layer.height, height))
+
+    out = img if img.mode == "RGB" else img.convert("RGB")
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return out
+
+    # Blend in the source's own mode (as RGBA) so partially transparent
+    # inputs come out exactly as a full-size composite would have.
+    region = img.crop(box).convert("RGBA")
+    text_part = layer.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+    out.paste(Image.alpha_composite(region, text_part).convert("RGB"), box[:2])
+    return out
+
+
+def add_watermark(image_bytes, text):
+    with stage("decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
+    with stage("watermark"):
+        combined = stamp(img, text)
 
-    combined = Image.alpha_composite(img, watermark)
-    buffer = io.BytesIO()
-    combined.convert("RGB").save(buffer, format="PNG")
+    with stage("png_encode"):
+        buffer = io.BytesIO()
+        combined.save(buffer, format="PNG")
     return buffer.getvalue()
@@ -3,8 +3,6 @@ import requests
 from PIL import Image
 import io
 import hashlib
-import math
-import numpy as np
 import matplotlib.pyplot as plt
 
 # ===================== CONFIGURATION =====================
@@ -512,32 +510,69 @@ with tab_dash:
         
     with col_analysis:
         if dash_file:
-            byte_data = dash_file.read()
-            
-            # Entropy calculation
-            probs = [byte_data.count(i)/len(byte_data) for i in set(byte_data)]
-            entropy = -sum([p * math.log2(p) for p in probs])
-            
-            st.subheader(f"Entropy: {entropy:.4f} bits/byte")
-            st.progress(min(entropy/8.0, 1.0))
-            
-            if entropy > 7.5:
-                st.success("High Entropy: File is likely encrypted or compressed.")
+            # The backend analyzes the file in one streaming pass; only the
+            # small precomputed arrays come back for plotting
+            with st.spinner("Analyzing..."):
+                try:
+                    res = requests.post(f"{BASE_URL}/analyze", files={"file": dash_file})
+                except requests.exceptions.RequestException:
+                    res = None
+
+            if res is None:
+                st.error("Backend offline")
+            elif res.status_code != 200:
+                st.error(f"Error: {res.text}")
             else:
-                st.warning("Low Entropy: File likely contains plaintext or structure.")
-            
-            # Histogram
-            try:
-                img = Image.open(io.BytesIO(byte_data))
-                st.markdown("#### Pixel Distribution (Histogram)")
-                arr = np.array(img)
-                fig, ax = plt.subplots(figsize=(10, 3))
-                ax.hist(arr.ravel(), bins=256, color='cyan', alpha=0.7)
-                ax.set_facecolor('#0e1117')
+                report = res.json()
+                entropy = report["entropy"]
+
+                st.subheader(f"Entropy: {entropy:.4f} bits/byte")
+                st.progress(min(entropy/8.0, 1.0))
+
+                if entropy > 7.5:
+                    st.success("High Entropy: File is likely encrypted or compressed.")
+                else:
+                    st.warning("Low Entropy: File likely contains plaintext or structure.")
+
+                s1, s2, s3 = st.columns(3)
+                s1.metric("Chi-square", f"{report['chi_square']:.1f}",
+                          help="Uniform random bytes give about 255")
+                if report["chi_square_p"] is not None:
+                    s2.metric("Chi-square p", f"{report['chi_square_p']:.4f}",
+                              help="Very close to 0 or 1 means not uniformly random")
+                if report["serial_correlation"] is not None:
+                    s3.metric("Serial Correlation", f"{report['serial_correlation']:.4f}",
+                              help="Close to 0 for random data")
+
+                fig, (ax_map, ax_bytes) = plt.subplots(2, 1, figsize=(10, 5))
+                ax_map.plot(report["block_entropy"], color='cyan')
+                ax_map.set_ylim(0, 8.1)
+                ax_map.set_title(f"Entropy per {report['block_size'] // 1024} KiB block", color='white')
+                ax_bytes.bar(range(256), report["byte_histogram"], width=1.0, color='cyan', alpha=0.7)
+                ax_bytes.set_title("Byte Distribution", color='white')
                 fig.patch.set_facecolor('#0e1117')
-                ax.tick_params(colors='white')
-                ax.spines['bottom'].set_color('white')
-                ax.spines['left'].set_color('white') 
+                for ax in (ax_map, ax_bytes):
+                    ax.set_facecolor('#0e1117')
+                    ax.tick_params(colors='white')
+                    ax.spines['bottom'].set_color('white')
+                    ax.spines['left'].set_color('white')
+                fig.tight_layout()
                 st.pyplot(fig)
-            except:
-                st.info("Not an image file - skipping histogram.")
+
+                # Histogram
+                image = report["image"]
+                if image:
+                    st.markdown("#### Pixel Distribution (Histogram)")
+                    colors = {"R": "red", "G": "lime", "B": "deepskyblue", "A": "white", "L": "cyan"}
+                    fig, ax = plt.subplots(figsize=(10, 3))
+                    for band, counts in image["channels"].items():
+                        ax.plot(counts, color=colors.get(band, "cyan"), alpha=0.8, label=band)
+                    ax.legend()
+                    ax.set_facecolor('#0e1117')
+                    fig.patch.set_facecolor('#0e1117')
+                    ax.tick_params(colors='white')
+                    ax.spines['bottom'].set_color('white')
+                    ax.spines['left'].set_color('white')
+                    st.pyplot(fig)
+                else:
+                    st.info("Not an image file - skipping histogram.")